@@ -4,9 +4,12 @@ Application FastAPI centrale - Home Serveur
 Port 5000 - Accessible via VPN WireGuard
 """
 
+import hashlib
 import os
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse, FileResponse
+import tempfile
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
 from pathlib import Path
@@ -15,29 +18,102 @@ import secrets
 # Importer les routers des services
 from services.wifi import router as wifi_router
 from services.monetariat import router as monetariat_router
+from services.monetariat.auth import AuthMiddleware
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Démarrage et arrêt des services"""
+    await wifi_router.startup()
+    await monetariat_router.startup()
+    yield
+    await monetariat_router.shutdown()
+    await wifi_router.shutdown()
 
 # Configuration
 app = FastAPI(
     title="Home Serveur",
     description="Serveur personnel - Monitoring & Services",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    # Sérialisation JSON en C (orjson) pour toutes les routes /api
+    default_response_class=ORJSONResponse
 )
 
+def load_or_create_secret_key(path: Path) -> str:
+    """
+    Lit la clé de session persistée, ou la génère une seule fois
+    L'écriture est atomique : si plusieurs workers démarrent en même temps,
+    tous finissent par utiliser la même clé
+    """
+    try:
+        return path.read_text().strip()
+    except FileNotFoundError:
+        pass
+    
+    path.parent.mkdir(parents=True, exist_ok=True)
+    key = secrets.token_urlsafe(32)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".session_key.")  # mode 0600
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(key)
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            # Un autre worker a créé la clé entre-temps
+            return path.read_text().strip()
+    finally:
+        os.unlink(tmp_path)
+    return key
+
 # Clé secrète pour les sessions
-# En production, définir SESSION_SECRET_KEY dans les variables d'environnement
-SECRET_KEY = os.getenv("SESSION_SECRET_KEY", secrets.token_urlsafe(32))
+# SESSION_SECRET_KEY si définie, sinon clé persistée dans SESSION_KEY_FILE
+# (les sessions survivent aux redémarrages et sont valides sur tous les workers)
+SESSION_KEY_FILE = Path(os.getenv(
+    "SESSION_KEY_FILE",
+    str(Path(__file__).parent / "databases" / ".session_key")
+))
+SECRET_KEY = os.getenv("SESSION_SECRET_KEY") or load_or_create_secret_key(SESSION_KEY_FILE)
+# AuthMiddleware est ajouté en premier pour s'exécuter à l'intérieur de
+# SessionMiddleware, qui décode la session avant lui
+app.add_middleware(
+    AuthMiddleware,
+    protected_prefixes=("/monetariat",),
+    login_path="/monetariat/login"
+)
 app.add_middleware(SessionMiddleware, secret_key=SECRET_KEY)
 
 # Inclure les routers des services
 app.include_router(wifi_router.router, prefix="/wifi", tags=["WiFi Monitor"])
 app.include_router(monetariat_router.router, prefix="/monetariat", tags=["Monétariat"])
 
+# Page d'accueil statique : chargée une seule fois au démarrage
+HOME_HTML = (Path(__file__).parent / "templates" / "home" / "index.html").read_bytes()
+HOME_ETAG = f'"{hashlib.blake2b(HOME_HTML, digest_size=8).hexdigest()}"'
+HOME_HEADERS = {"etag": HOME_ETAG, "cache-control": "public, max-age=3600"}
+
 @app.get("/", response_class=HTMLResponse)
-async def home():
+async def home(request: Request):
     """Page d'accueil - Liste des services"""
-    html_path = Path(__file__).parent / "templates" / "home" / "index.html"
-    return FileResponse(html_path)
+    if_none_match = request.headers.get("if-none-match", "")
+    if HOME_ETAG in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=HOME_HEADERS)
+    return Response(HOME_HTML, media_type="text/html", headers=HOME_HEADERS)
 
 if __name__ == "__main__": 
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=5000)
\ No newline at end of file
+    from services.wifi import database as wifi_db
+    from services.monetariat import database as monetariat_db
+    # Schémas créés une seule fois avant de lancer les workers : au démarrage,
+    # chacun constate que la base est à jour sans exécuter de DDL
+    wifi_db.init_db()
+    monetariat_db.init_db()
+    # uvloop + httptools (extras uvicorn[standard]), un worker par cœur (max 4)
+    workers = int(os.getenv("UVICORN_WORKERS", min(4, os.cpu_count() or 1)))
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=5000,
+        loop="uvloop",
+        http="httptools",
+        workers=workers
+    )
@@ -4,11 +4,13 @@ Service d'authentification pour Monétariat
 """
 
 import os
+import bcrypt
 from passlib.context import CryptContext
-from fastapi import Request, HTTPException, status
-from fastapi.responses import RedirectResponse
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
 
 # Configuration du hachage de mot de passe avec bcrypt
+# (utilisé pour générer les hash ; la vérification appelle bcrypt directement)
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # Mot de passe par défaut: admin123
@@ -18,19 +20,33 @@ DEFAULT_PASSWORD_HASH = os.getenv(
     "MONETARIAT_PASSWORD_HASH",
     "$2b$12$HPiI9EX3bPAB5n1GrjglRO1RfH095ybG2OEpiI2zB6S08RPdjHD92"  # admin123
 )
+# Encodé une seule fois pour la vérification bcrypt
+DEFAULT_PASSWORD_HASH_BYTES = DEFAULT_PASSWORD_HASH.encode('utf-8')
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+async def verify_password(plain_password: str, hashed_password: str | bytes) -> bool:
     """
     Vérifie si le mot de passe en clair correspond au hash
+    Le calcul bcrypt (plusieurs dizaines de ms) est exécuté dans le threadpool
+    pour ne pas bloquer la boucle d'événements
     
     Args:
         plain_password: Mot de passe en clair
-        hashed_password: Hash du mot de passe
+        hashed_password: Hash du mot de passe (str ou bytes déjà encodés)
     
     Returns:
         True si le mot de passe correspond, False sinon
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return await run_in_threadpool(_check_bcrypt, plain_password, hashed_password)
+
+def _check_bcrypt(plain_password: str, hashed_password: str | bytes) -> bool:
+    """Vérification bcrypt sans passer par le registre de passlib"""
+    if isinstance(hashed_password, str):
+        hashed_password = hashed_password.encode('utf-8')
+    try:
+        return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password)
+    except ValueError:
+        # Hash mal formé
+        return False
 
 def get_password_hash(password: str) -> str:
     """
@@ -47,6 +63,7 @@ def get_password_hash(password: str) -> str:
 def check_authentication(request: Request) -> bool:
     """
     Vérifie si l'utilisateur est authentifié via la session
+    Réutilise le résultat déjà calculé par AuthMiddleware s'il existe
     
     Args:
         request: Requête FastAPI
@@ -54,21 +71,55 @@ def check_authentication(request: Request) -> bool:
     Returns:
         True si authentifié, False sinon
     """
-    return request.session.get("authenticated", False)
+    authenticated = getattr(request.state, "authenticated", None)
+    if authenticated is None:
+        authenticated = request.session.get("authenticated", False)
+    return authenticated
 
-async def require_authentication(request: Request):
+class AuthMiddleware:
     """
-    Dépendance FastAPI pour protéger les routes
-    Redirige vers /monetariat/login si non authentifié
+    Middleware ASGI protégeant les routes sous les préfixes donnés
+    Redirige (307) vers la page de connexion si la session n'est pas
+    authentifiée, sans passer par la gestion d'exceptions de FastAPI.
+    Doit être placé à l'intérieur de SessionMiddleware (scope["session"]).
+    Le résultat est lu une seule fois par requête et exposé aux routes
+    dans request.state.authenticated.
     
     Args:
-        request: Requête FastAPI
-    
-    Raises:
-        HTTPException: Si non authentifié, redirige vers login
+        app: Application ASGI
+        protected_prefixes: Préfixes de chemins protégés (ex: ("/monetariat",))
+        login_path: Page de connexion (toujours accessible)
     """
-    if not check_authentication(request):
-        raise HTTPException(
-            status_code=status.HTTP_307_TEMPORARY_REDIRECT,
-            headers={"Location": "/monetariat/login"}
+    
+    def __init__(self, app, protected_prefixes, login_path):
+        self.app = app
+        self.protected_prefixes = tuple(protected_prefixes)
+        self.login_path = login_path
+        self._redirect_headers = [(b"location", login_path.encode("latin-1"))]
+    
+    def _is_protected(self, path: str) -> bool:
+        if path == self.login_path:
+            return False
+        return any(
+            path == prefix or path.startswith(prefix + "/")
+            for prefix in self.protected_prefixes
         )
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        authenticated = bool(scope.get("session", {}).get("authenticated", False))
+        scope.setdefault("state", {})["authenticated"] = authenticated
+        
+        if authenticated or not self._is_protected(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        
+        await send({
+            "type": "http.response.start",
+            "status": 307,
+            "headers": self._redirect_headers + [(b"content-length", b"0")],
+        })
+        await send({"type": "http.response.body", "body": b""})
@@ -3,7 +3,13 @@
 Gestion de la base de données Monétariat
 """
 
+import queue
 import sqlite3
+import string
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
 from datetime import datetime
 
@@ -11,17 +17,355 @@ from datetime import datetime
 BASE_DIR = Path(__file__).parent.parent.parent
 DB_PATH = BASE_DIR / "databases" / "monetariat.db"
 
-def get_db_connection():
-    """Crée une connexion à la base de données"""
-    conn = sqlite3.connect(str(DB_PATH))
-    conn.row_factory = sqlite3.Row
-    return conn
+# Taille de page appliquée à la création (ne peut changer qu'hors mode WAL)
+PAGE_SIZE = 8192
+
+# Version du schéma (PRAGMA user_version) : à incrémenter à chaque ajout de
+# table, d'index ou de donnée par défaut dans init_db()
+SCHEMA_VERSION = 3
+
+# Tables de référence (comptes, catégories...) dont les lectures sont mises
+# en cache par le router, invalidé via reference_version
+REFERENCE_TABLES = ('accounts', 'categories', 'payment_methods', 'subscriptions')
+
+# Requêtes préparées gardées compilées par connexion (défaut Python: 128)
+STATEMENT_CACHE_SIZE = 256
+
+# Attente maximale (secondes) du résultat d'une écriture soumise au WriterThread
+WRITE_TIMEOUT = 30
+
+# Colonnes d'insertion d'une transaction (ordre des paramètres)
+TRANSACTION_COLUMNS = (
+    'date', 'compte_id', 'montant', 'categorie_id', 'description', 'necessite',
+    'necessity_level', 'mode_paiement_id', 'type', 'compte_destination_id', 'subscription_id'
+)
+REQUIRED_TRANSACTION_COLUMNS = ('date', 'compte_id', 'montant', 'type')
+_REQUIRED_INDEXES = tuple(
+    (TRANSACTION_COLUMNS.index(col), col) for col in REQUIRED_TRANSACTION_COLUMNS
+)
+_MONTANT_INDEX = TRANSACTION_COLUMNS.index('montant')
+_COMPTE_INDEX = TRANSACTION_COLUMNS.index('compte_id')
+
+# Construite une seule fois : le texte SQL identique à chaque appel est
+# retrouvé dans le cache de requêtes préparées de la connexion
+INSERT_TRANSACTION_SQL = f'''
+    INSERT INTO transactions ({', '.join(TRANSACTION_COLUMNS)})
+    VALUES ({', '.join('?' * len(TRANSACTION_COLUMNS))})
+'''
+
+# RETURNING (SQLite >= 3.35) renvoie l'id dans la même instruction que l'INSERT
+RETURNING_SUPPORTED = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+def with_returning_id(sql):
+    """Ajoute RETURNING id à un INSERT si SQLite le permet"""
+    return f'{sql.rstrip()} RETURNING id' if RETURNING_SUPPORTED else sql
+
+def insert_returning_id(conn, sql, params):
+    """Exécute un INSERT et retourne l'id de la ligne créée
+    Via RETURNING si disponible, sinon via cursor.lastrowid
+    """
+    cursor = conn.execute(with_returning_id(sql), params)
+    if cursor.description is not None:
+        return cursor.fetchone()[0]
+    return cursor.lastrowid
+
+INSERT_TRANSACTION_RETURNING_SQL = with_returning_id(INSERT_TRANSACTION_SQL)
+
+# COLLATE NOCASE ne replie que les lettres ASCII
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+def nocase_key(text):
+    """Clé de comparaison équivalente à COLLATE NOCASE"""
+    return text.translate(_ASCII_LOWER)
+
+def configure_connection(conn):
+    """Applique les PRAGMA de performance à une connexion
+    Le mode WAL est persistant et activé une seule fois dans init_db()
+    """
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')  # 64 Mo
+    conn.execute('PRAGMA mmap_size=268435456')  # 256 Mo
+    conn.execute('PRAGMA foreign_keys=ON')
+
+class ConnectionPool:
+    """Pool de connexions SQLite réutilisées entre les requêtes
+    
+    Les connexions restent ouvertes (cache de pages et de requêtes chaud) et
+    sont créées à la demande jusqu'à `size`, puis partagées entre les threads.
+    """
+    
+    def __init__(self, db_path, size=8, configure=None):
+        self.db_path = db_path
+        self.size = size
+        self.configure = configure
+        self._idle = queue.Queue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        conn = sqlite3.connect(
+            str(self.db_path),
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        if self.configure:
+            self.configure(conn)
+        return conn
+    
+    def acquire(self):
+        """Emprunte une connexion (bloque si toutes sont utilisées)"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        
+        if not can_create:
+            return self._idle.get()
+        try:
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+    
+    def release(self, conn):
+        """Rend une connexion au pool en annulant toute transaction en cours"""
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put_nowait(conn)
+    
+    @contextmanager
+    def connection(self):
+        """Context manager: emprunte puis rend une connexion"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+    
+    def close_all(self):
+        """Ferme les connexions inactives du pool
+        PRAGMA optimize est exécuté avant chaque fermeture (recommandation SQLite)
+        """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.execute('PRAGMA optimize')
+            except sqlite3.Error:
+                pass
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+@dataclass
+class WriteJob:
+    """Écriture en attente dans la file du WriterThread"""
+    sql: str
+    params: tuple
+    future: Future
+
+class WriterThread:
+    """Thread unique d'écriture SQLite
+    
+    Les écritures soumises sont sérialisées sur une seule connexion : plus de
+    SQLITE_BUSY entre écrivains concurrents. Les travaux déjà en file sont
+    regroupés dans une même transaction (un seul COMMIT) ; les lectures
+    continuent de passer par le pool.
+    """
+    
+    def __init__(self, db_path, configure=None, max_batch=256):
+        self.db_path = db_path
+        self.configure = configure
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Erreur qui a arrêté le thread : les écritures suivantes échouent aussitôt
+        self._error = None
+    
+    def submit(self, sql, params=()):
+        """Met une écriture en file; le Future reçoit l'id retourné (RETURNING) ou le lastrowid"""
+        job = WriteJob(sql, tuple(params), Future())
+        with self._lock:
+            if self._error is not None:
+                job.future.set_exception(self._error)
+                return job.future
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="monetariat-writer", daemon=True
+                )
+                self._thread.start()
+            self._queue.put(job)
+        return job.future
+    
+    def stop(self):
+        """Termine les écritures en file puis arrête le thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._error = None
+        # Un thread déjà arrêté sur erreur ne lirait pas le signal d'arrêt
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+    
+    def _run(self):
+        conn = None
+        batch = []
+        try:
+            conn = sqlite3.connect(str(self.db_path), cached_statements=STATEMENT_CACHE_SIZE)
+            if self.configure:
+                self.configure(conn)
+            while True:
+                job = self._queue.get()
+                if job is None:
+                    return
+                batch = [job]
+                # Regrouper ce qui est déjà en attente, sans délai supplémentaire
+                while len(batch) < self.max_batch:
+                    try:
+                        job = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is None:
+                        self._execute_batch(conn, batch)
+                        return
+                    batch.append(job)
+                self._execute_batch(conn, batch)
+        except Exception as e:
+            # Thread arrêté (connexion impossible, erreur inattendue) : aucune
+            # écriture ne doit rester en attente d'un résultat qui ne viendra pas
+            self._fail(e, batch)
+        finally:
+            if conn is not None:
+                conn.close()
+    
+    def _fail(self, error, batch):
+        """Fait échouer le lot en cours et toutes les écritures en file"""
+        with self._lock:
+            self._error = error
+        jobs = list(batch)
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                jobs.append(job)
+        for job in jobs:
+            if not job.future.done():
+                job.future.set_exception(error)
+    
+    @staticmethod
+    def _execute_batch(conn, batch):
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for job in batch:
+                # Une erreur de contrainte n'annule que l'instruction fautive
+                try:
+                    cursor = conn.execute(job.sql, job.params)
+                    if cursor.description is not None:
+                        # INSERT ... RETURNING id
+                        row_id = cursor.fetchone()[0]
+                    else:
+                        row_id = cursor.lastrowid
+                    results.append((job, row_id, None))
+                except sqlite3.Error as e:
+                    results.append((job, None, e))
+            conn.commit()
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for job in batch:
+                job.future.set_exception(e)
+            return
+        
+        for job, rowid, error in results:
+            if error is None:
+                job.future.set_result(rowid)
+            else:
+                job.future.set_exception(error)
+
+_pool = ConnectionPool(DB_PATH, size=8, configure=configure_connection)
+_writer = WriterThread(DB_PATH, configure=configure_connection)
+
+def get_db():
+    """Context manager donnant une connexion du pool
+    
+    Usage:
+        with get_db() as conn:
+            conn.execute(...)
+    """
+    return _pool.connection()
+
+def optimize_db():
+    """Rafraîchit les statistiques du planificateur de requêtes"""
+    with get_db() as conn:
+        conn.execute('PRAGMA optimize')
+
+def submit_write(sql, params=()):
+    """Exécute une écriture via le thread d'écriture et retourne l'id de la ligne écrite"""
+    return _writer.submit(sql, params).result(timeout=WRITE_TIMEOUT)
+
+def close_db():
+    """Arrête le thread d'écriture et ferme les connexions du pool"""
+    _writer.stop()
+    _pool.close_all()
+
+_initialized = False
+
+def is_db_initialized():
+    """Vérifie en une seule requête (connexion en lecture seule) que le
+    schéma courant est en place et que les comptes par défaut existent
+    """
+    if not DB_PATH.exists():
+        return False
+    conn = sqlite3.connect(f'{DB_PATH.resolve().as_uri()}?mode=ro', uri=True)
+    try:
+        row = conn.execute(
+            'SELECT (SELECT user_version FROM pragma_user_version) >= ? '
+            'AND EXISTS (SELECT 1 FROM accounts)',
+            (SCHEMA_VERSION,)
+        ).fetchone()
+        return bool(row[0])
+    except sqlite3.Error:
+        # Table absente ou base illisible : initialisation complète
+        return False
+    finally:
+        conn.close()
 
 def init_db():
-    """Initialise la base de données"""
+    """Initialise la base de données (une seule fois par processus,
+    et sans rien réécrire si le schéma est déjà à jour)
+    """
+    global _initialized
+    if _initialized or is_db_initialized():
+        _initialized = True
+        return
+    
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
     
     conn = sqlite3.connect(str(DB_PATH))
+    
+    # page_size ne peut être modifié qu'en dehors du mode WAL (VACUUM requis
+    # si la base existe déjà), puis on active WAL de façon persistante
+    if conn.execute('PRAGMA page_size').fetchone()[0] != PAGE_SIZE:
+        conn.execute('PRAGMA journal_mode=DELETE')
+        conn.execute(f'PRAGMA page_size={PAGE_SIZE}')
+        conn.execute('VACUUM')
+    conn.execute('PRAGMA journal_mode=WAL')
+    configure_connection(conn)
+    
     cursor = conn.cursor()
     
     # Table des comptes
@@ -88,6 +432,50 @@ def init_db():
         )
     ''')
     
+    # Index des requêtes fréquentes (tri du journal, soldes par compte)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tx_date
+        ON transactions(date DESC, created_at DESC)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tx_compte_type
+        ON transactions(compte_id, type)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tx_dest_type
+        ON transactions(compte_destination_id, type)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tx_cat
+        ON transactions(categorie_id)
+    ''')
+    
+    # Les catégories d'un import sont comparées en Python (resolve_categories) :
+    # aucune requête n'utilise plus cet index
+    cursor.execute('DROP INDEX IF EXISTS idx_cat_nom_nocase')
+    
+    # Version des données de référence, incrémentée par trigger à chaque
+    # écriture : les caches de tous les workers savent quand se rafraîchir
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reference_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO reference_version (id, version) VALUES (1, 0)')
+    for table in REFERENCE_TABLES:
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{event.lower()}_version
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE reference_version SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+    
     # Insérer les comptes par défaut
     cursor.execute('SELECT COUNT(*) FROM accounts')
     if cursor.fetchone()[0] == 0:
@@ -95,349 +483,357 @@ def init_db():
         cursor.execute("INSERT INTO accounts (nom, type, solde_initial) VALUES ('Épargne', 'epargne', 0)")
         cursor.execute("INSERT INTO accounts (nom, type, solde_initial) VALUES ('Crédit', 'credit', 0)")
     
-    # Insérer les catégories par défaut - DÉPENSES
+    # Insérer les catégories par défaut (dépenses puis revenus)
     default_expense_categories = [
         'Alimentation', 'Transport', 'Logement', 'Loisirs', 
         'Santé', 'Abonnement', 'Autres'
     ]
-    for cat in default_expense_categories:  
-        cursor.execute(
-            "INSERT OR IGNORE INTO categories (nom, type) VALUES (?, 'depense')",
-            (cat,)
-        )
-    
-    # Insérer les catégories par défaut - REVENUS
     default_income_categories = ['Salaire', 'Remboursement', 'Autres']
-    for cat in default_income_categories:
-        cursor.execute(
-            "INSERT OR IGNORE INTO categories (nom, type) VALUES (?, 'revenu')",
-            (cat,)
-        )
+    cursor.executemany(
+        "INSERT OR IGNORE INTO categories (nom, type) VALUES (?, ?)",
+        [(cat, 'depense') for cat in default_expense_categories]
+        + [(cat, 'revenu') for cat in default_income_categories]
+    )
     
     # Insérer les modes de paiement par défaut
     default_payment_methods = ['Comptant', 'Carte', 'Virement', 'Chèque']
-    for method in default_payment_methods:  
-        cursor.execute(
-            "INSERT OR IGNORE INTO payment_methods (nom) VALUES (?)",
-            (method,)
-        )
+    cursor.executemany(
+        "INSERT OR IGNORE INTO payment_methods (nom) VALUES (?)",
+        [(method,) for method in default_payment_methods]
+    )
     
+    cursor.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
     conn.commit()
+    
+    # Statistiques du planificateur (calculées une seule fois, à la création)
+    has_stats = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+    ).fetchone()
+    if not has_stats:
+        cursor.execute('ANALYZE')
+    cursor.execute('PRAGMA optimize')
+    
     conn.close()
+    _initialized = True
 
 # Fonctions CRUD
 
+def get_reference_version():
+    """Version courante des données de référence (voir REFERENCE_TABLES)"""
+    with get_db() as conn:
+        return conn.execute('SELECT version FROM reference_version WHERE id = 1').fetchone()[0]
+
 def get_all_accounts():
     """Récupère tous les comptes"""
-    conn = get_db_connection()
-    accounts = conn.execute('SELECT * FROM accounts ORDER BY id').fetchall()
-    conn.close()
+    with get_db() as conn:
+        accounts = conn.execute('SELECT id, nom, type, solde_initial FROM accounts ORDER BY id').fetchall()
     return [dict(row) for row in accounts]
 
 def get_categories_by_type(cat_type):
     """Récupère les catégories par type (depense/revenu)"""
-    conn = get_db_connection()
-    categories = conn.execute(
-        'SELECT * FROM categories WHERE type = ? ORDER BY nom',
-        (cat_type,)
-    ).fetchall()
-    conn.close()
+    with get_db() as conn:
+        categories = conn.execute(
+            'SELECT id, nom, type, ordre FROM categories WHERE type = ? ORDER BY nom',
+            (cat_type,)
+        ).fetchall()
     return [dict(row) for row in categories]
 
 def get_categories_sorted(cat_type):
     """Récupère les catégories triées avec 'Autres' à la fin et ordre personnalisé"""
-    conn = get_db_connection()
-    categories = conn.execute('''
-        SELECT * FROM categories 
-        WHERE type = ? 
-        ORDER BY 
-            ordre ASC,
-            CASE WHEN LOWER(nom) = 'autres' THEN 1 ELSE 0 END,
-            nom
-    ''', (cat_type,)).fetchall()
-    conn.close()
+    with get_db() as conn:
+        categories = conn.execute('''
+            SELECT id, nom, type, ordre FROM categories 
+            WHERE type = ? 
+            ORDER BY 
+                ordre ASC,
+                CASE WHEN LOWER(nom) = 'autres' THEN 1 ELSE 0 END,
+                nom
+        ''', (cat_type,)).fetchall()
     return [dict(row) for row in categories]
 
 def get_all_payment_methods():
     """Récupère tous les modes de paiement"""
-    conn = get_db_connection()
-    methods = conn.execute('SELECT * FROM payment_methods ORDER BY nom').fetchall()
-    conn.close()
+    with get_db() as conn:
+        methods = conn.execute('SELECT id, nom FROM payment_methods ORDER BY nom').fetchall()
     return [dict(row) for row in methods]
 
 def get_all_subscriptions():
     """Récupère tous les abonnements"""
-    conn = get_db_connection()
-    subs = conn.execute('SELECT * FROM subscriptions ORDER BY nom').fetchall()
-    conn.close()
+    with get_db() as conn:
+        subs = conn.execute('SELECT id, nom FROM subscriptions ORDER BY nom').fetchall()
     return [dict(row) for row in subs]
 
 def add_category(nom, cat_type):
     """Ajoute une nouvelle catégorie"""
-    conn = get_db_connection()
-    try:
-        cursor = conn.execute(
-            'INSERT INTO categories (nom, type) VALUES (?, ?)',
-            (nom, cat_type)
-        )
-        conn.commit()
-        category_id = cursor.lastrowid
-        conn.close()
-        return {'id': category_id, 'nom': nom, 'type': cat_type}
-    except sqlite3.IntegrityError:
-        conn.close()
-        return None
+    with get_db() as conn:
+        try:
+            category_id = insert_returning_id(
+                conn,
+                'INSERT INTO categories (nom, type) VALUES (?, ?)',
+                (nom, cat_type)
+            )
+            conn.commit()
+            return {'id': category_id, 'nom': nom, 'type': cat_type}
+        except sqlite3.IntegrityError:
+            return None
 
 def add_subscription(nom):
     """Ajoute un nouvel abonnement"""
-    conn = get_db_connection()
-    try:
-        cursor = conn.execute(
-            'INSERT INTO subscriptions (nom) VALUES (?)',
-            (nom,)
-        )
-        conn.commit()
-        subscription_id = cursor.lastrowid
-        conn.close()
-        return {'id': subscription_id, 'nom': nom}
-    except sqlite3.IntegrityError:
-        conn.close()
-        return None
+    with get_db() as conn:
+        try:
+            subscription_id = insert_returning_id(
+                conn,
+                'INSERT INTO subscriptions (nom) VALUES (?)',
+                (nom,)
+            )
+            conn.commit()
+            return {'id': subscription_id, 'nom': nom}
+        except sqlite3.IntegrityError:
+            return None
 
 def delete_category(category_id):
     """Supprime une catégorie"""
-    conn = get_db_connection()
-    try:
-        # Vérifier si la catégorie est utilisée
-        cursor = conn.execute(
-            'SELECT COUNT(*) FROM transactions WHERE categorie_id = ?',
-            (category_id,)
-        )
-        count = cursor.fetchone()[0]
-        
-        if count > 0:
-            conn.close()
-            return {'error': f'Impossible de supprimer :  {count} transaction(s) utilisent cette catégorie'}
-        
-        conn.execute('DELETE FROM categories WHERE id = ?', (category_id,))
-        conn.commit()
-        conn.close()
-        return {'success': True}
-    except Exception as e: 
-        conn.close()
-        return {'error':  str(e)}
+    with get_db() as conn:
+        try:
+            # Vérifier si la catégorie est utilisée
+            cursor = conn.execute(
+                'SELECT COUNT(*) FROM transactions WHERE categorie_id = ?',
+                (category_id,)
+            )
+            count = cursor.fetchone()[0]
+            
+            if count > 0:
+                return {'error': f'Impossible de supprimer :  {count} transaction(s) utilisent cette catégorie'}
+            
+            conn.execute('DELETE FROM categories WHERE id = ?', (category_id,))
+            conn.commit()
+            return {'success': True}
+        except Exception as e: 
+            return {'error':  str(e)}
 
 def update_categories_order(category_orders):
     """Met à jour l'ordre de plusieurs catégories
     category_orders: liste de dict avec {id: x, ordre: y}
     """
-    conn = get_db_connection()
-    try:
-        for item in category_orders:
-            conn.execute(
-                'UPDATE categories SET ordre = ?  WHERE id = ?',
-                (item['ordre'], item['id'])
-            )
-        conn.commit()
-        conn.close()
-        return {'success': True}
-    except Exception as e: 
-        conn.close()
-        return {'error': str(e)}
+    with get_db() as conn:
+        try:
+            params = [(item['ordre'], item['id']) for item in category_orders]
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('UPDATE categories SET ordre = ? WHERE id = ?', params)
+            conn.commit()
+            return {'success': True}
+        except Exception as e: 
+            return {'error': str(e)}
+
+def transaction_row(data):
+    """Convertit un dict de transaction en tuple (ordre de TRANSACTION_COLUMNS)"""
+    return tuple(data.get(col) for col in TRANSACTION_COLUMNS)
 
 def add_transaction(data):
     """Ajoute une nouvelle transaction"""
-    conn = get_db_connection()
-    cursor = conn.execute('''
-        INSERT INTO transactions 
-        (date, compte_id, montant, categorie_id, description, necessite, 
-         necessity_level, mode_paiement_id, type, compte_destination_id, subscription_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        data['date'],
-        data['compte_id'],
-        data['montant'],
-        data.get('categorie_id'),
-        data.get('description'),
-        data.get('necessite'),
-        data.get('necessity_level'),
-        data.get('mode_paiement_id'),
-        data['type'],
-        data.get('compte_destination_id'),
-        data.get('subscription_id')
-    ))
-    conn.commit()
-    transaction_id = cursor.lastrowid
-    
-    conn.close()
-    return transaction_id
+    return submit_write(INSERT_TRANSACTION_RETURNING_SQL, transaction_row(data))
 
 def get_all_transactions(limit=100):
-    """Récupère toutes les transactions"""
-    conn = get_db_connection()
-    transactions = conn.execute('''
-        SELECT 
-            t.*,
-            a.nom as compte_nom,
-            c.nom as categorie_nom,
-            pm.nom as mode_paiement_nom,
-            ad.nom as compte_destination_nom,
-            s.nom as subscription_nom
-        FROM transactions t
-        LEFT JOIN accounts a ON t.compte_id = a.id
-        LEFT JOIN categories c ON t.categorie_id = c.id
-        LEFT JOIN payment_methods pm ON t.mode_paiement_id = pm.id
-        LEFT JOIN accounts ad ON t.compte_destination_id = ad.id
-        LEFT JOIN subscriptions s ON t.subscription_id = s.id
-        ORDER BY t.date DESC, t.created_at DESC
-        LIMIT ?  
-    ''', (limit,)).fetchall()
-    conn.close()
+    """Récupère toutes les transactions
+    Seules les colonnes affichées par le dashboard sont projetées
+    """
+    with get_db() as conn:
+        transactions = conn.execute('''
+            SELECT 
+                t.id,
+                t.date,
+                t.montant,
+                t.type,
+                t.description,
+                t.compte_id,
+                t.compte_destination_id,
+                t.categorie_id,
+                a.nom as compte_nom,
+                c.nom as categorie_nom
+            FROM transactions t
+            LEFT JOIN accounts a ON t.compte_id = a.id
+            LEFT JOIN categories c ON t.categorie_id = c.id
+            ORDER BY t.date DESC, t.created_at DESC
+            LIMIT ?  
+        ''', (limit,)).fetchall()
     return [dict(row) for row in transactions]
 
 def update_account_balance(account_id, new_balance):
     """Met à jour le solde d'un compte"""
-    conn = get_db_connection()
-    try:
-        conn.execute(
-            'UPDATE accounts SET solde_initial = ? WHERE id = ?',
-            (new_balance, account_id)
-        )
-        conn.commit()
-        conn.close()
-        return {'success': True}
-    except Exception as e:
-        conn.close()
-        return {'error': str(e)}
+    with get_db() as conn:
+        try:
+            conn.execute(
+                'UPDATE accounts SET solde_initial = ? WHERE id = ?',
+                (new_balance, account_id)
+            )
+            conn.commit()
+            return {'success': True}
+        except Exception as e:
+            return {'error': str(e)}
 
 def update_account_name(account_id, new_name):
     """Met à jour le nom d'un compte"""
-    conn = get_db_connection()
-    try:
-        conn.execute(
-            'UPDATE accounts SET nom = ? WHERE id = ?',
-            (new_name, account_id)
-        )
-        conn.commit()
-        conn.close()
-        return {'success':  True}
-    except sqlite3.IntegrityError:
-        conn.close()
-        return {'error': 'Ce nom de compte existe déjà'}
-    except Exception as e:
-        conn.close()
-        return {'error': str(e)}
+    with get_db() as conn:
+        try:
+            conn.execute(
+                'UPDATE accounts SET nom = ? WHERE id = ?',
+                (new_name, account_id)
+            )
+            conn.commit()
+            return {'success':  True}
+        except sqlite3.IntegrityError:
+            return {'error': 'Ce nom de compte existe déjà'}
+        except Exception as e:
+            return {'error': str(e)}
 
 def get_account_summary():
-    """Récupère le résumé de tous les comptes avec leurs soldes calculés"""
-    conn = get_db_connection()
+    """Récupère le résumé de tous les comptes avec leurs soldes calculés
+    Une seule requête agrégée pour tous les comptes
+    """
+    with get_db() as conn:
+        accounts = conn.execute('''
+            SELECT 
+                a.id, a.nom, a.type, a.solde_initial,
+                -- Revenus et transferts entrants
+                COALESCE(SUM(CASE
+                    WHEN (t.type = 'revenu' AND t.compte_id = a.id)
+                      OR (t.type = 'transfert' AND t.compte_destination_id = a.id)
+                    THEN t.montant END), 0) as revenus,
+                -- Dépenses et transferts sortants
+                COALESCE(SUM(CASE
+                    WHEN (t.type = 'depense' AND t.compte_id = a.id)
+                      OR (t.type = 'transfert' AND t.compte_id = a.id)
+                    THEN t.montant END), 0) as depenses
+            FROM accounts a
+            LEFT JOIN transactions t
+                ON t.compte_id = a.id OR t.compte_destination_id = a.id
+            GROUP BY a.id
+            ORDER BY a.id
+        ''').fetchall()
     
-    # Récupérer tous les comptes
-    accounts = conn.execute('SELECT * FROM accounts ORDER BY id').fetchall()
     result = []
-    
     for account in accounts:
         account_dict = dict(account)
-        account_id = account_dict['id']
-        
-        # Calculer le solde réel basé sur les transactions
-        # Revenus et transferts entrants
-        revenus = conn.execute('''
-            SELECT COALESCE(SUM(montant), 0) as total
-            FROM transactions
-            WHERE (type = 'revenu' AND compte_id = ?)
-               OR (type = 'transfert' AND compte_destination_id = ?)
-        ''', (account_id, account_id)).fetchone()[0]
-        
-        # Dépenses et transferts sortants
-        depenses = conn.execute('''
-            SELECT COALESCE(SUM(montant), 0) as total
-            FROM transactions
-            WHERE (type = 'depense' AND compte_id = ?)
-               OR (type = 'transfert' AND compte_id = ?)
-        ''', (account_id, account_id)).fetchone()[0]
-        
-        solde_reel = account_dict['solde_initial'] + revenus - depenses
-        account_dict['solde_reel'] = solde_reel
-        
+        revenus = account_dict.pop('revenus')
+        depenses = account_dict.pop('depenses')
+        account_dict['solde_reel'] = account_dict['solde_initial'] + revenus - depenses
         result.append(account_dict)
     
-    conn.close()
     return result
 
-def bulk_add_transactions(transactions_data):
-    """Ajoute plusieurs transactions en une seule fois
-    transactions_data: liste de dict avec les données de chaque transaction
+def validate_transaction_row(row):
+    """Vérifie une transaction (tuple dans l'ordre de TRANSACTION_COLUMNS)
+    Retourne un message d'erreur, ou None si la transaction est valide
+    """
+    for index, column in _REQUIRED_INDEXES:
+        if row[index] is None:
+            return f'Champ obligatoire manquant: {column}'
+    montant = row[_MONTANT_INDEX]
+    if isinstance(montant, bool) or not isinstance(montant, (int, float)):
+        return f"Montant invalide: {montant!r}"
+    compte_id = row[_COMPTE_INDEX]
+    if isinstance(compte_id, bool) or not isinstance(compte_id, int):
+        return f"Compte invalide: {compte_id!r}"
+    return None
+
+def bulk_add_transaction_rows(rows):
+    """Ajoute plusieurs transactions déjà sous forme de tuples
+    rows: séquences de valeurs dans l'ordre de TRANSACTION_COLUMNS
     Retourne:  dict avec succès, erreurs, et nombre importé
+    
+    Les lignes valides sont insérées avec un seul executemany (une seule
+    requête préparée) dans une transaction BEGIN IMMEDIATE. Si SQLite rejette
+    le lot (ex: clé étrangère), on rejoue ligne par ligne pour isoler les
+    lignes fautives.
     """
-    conn = get_db_connection()
-    imported = 0
     errors = []
+    valid = []
+    
+    def error_entry(idx, row, message):
+        # Le dict n'est reconstruit que pour les lignes en erreur
+        return {'line': idx + 1, 'error': message, 'data': dict(zip(TRANSACTION_COLUMNS, row))}
+    
+    for idx, row in enumerate(rows):
+        error = validate_transaction_row(row)
+        if error:
+            errors.append(error_entry(idx, row, error))
+        else:
+            valid.append((idx, row))
     
-    for idx, data in enumerate(transactions_data):
+    with get_db() as conn:
         try:
-            cursor = conn.execute('''
-                INSERT INTO transactions 
-                (date, compte_id, montant, categorie_id, description, necessite, 
-                 necessity_level, mode_paiement_id, type, compte_destination_id, subscription_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                data['date'],
-                data['compte_id'],
-                data['montant'],
-                data.get('categorie_id'),
-                data.get('description'),
-                data.get('necessite'),
-                data.get('necessity_level'),
-                data.get('mode_paiement_id'),
-                data['type'],
-                data.get('compte_destination_id'),
-                data.get('subscription_id')
-            ))
-            imported += 1
-        except Exception as e:
-            errors.append({
-                'line':  idx + 1,
-                'error': str(e),
-                'data': data
-            })
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(INSERT_TRANSACTION_SQL, [row for _, row in valid])
+            conn.commit()
+            imported = len(valid)
+        except sqlite3.Error:
+            conn.rollback()
+            imported = 0
+            conn.execute('BEGIN IMMEDIATE')
+            for idx, row in valid:
+                try:
+                    conn.execute(INSERT_TRANSACTION_SQL, row)
+                    imported += 1
+                except sqlite3.Error as e:
+                    errors.append(error_entry(idx, row, str(e)))
+            conn.commit()
     
-    conn.commit()
-    conn.close()
+    errors.sort(key=lambda error: error['line'])
     
     return {
         'success': True,
         'imported': imported,
         'errors': errors,
-        'total': len(transactions_data)
+        'total': len(rows)
     }
 
-def find_or_create_category(nom, cat_type):
-    """Trouve une catégorie ou la crée si elle n'existe pas
-    Retourne l'ID de la catégorie
+def resolve_categories(pairs):
+    """Trouve ou crée les catégories d'un import en une seule transaction
+    Les noms sont comparés sans tenir compte de la casse ; une catégorie
+    manquante est créée avec la première orthographe rencontrée
+    
+    Args:
+        pairs: Couples (nom, type) à résoudre
+    
+    Returns:
+        Dictionnaire {(nom, type): id}
     """
-    conn = get_db_connection()
+    pairs = list(dict.fromkeys(pairs))
+    if not pairs:
+        return {}
     
-    # Chercher la catégorie existante
-    result = conn.execute(
-        'SELECT id FROM categories WHERE LOWER(nom) = LOWER(?) AND type = ?',
-        (nom, cat_type)
-    ).fetchone()
+    types = sorted({cat_type for _, cat_type in pairs})
+    placeholders = ', '.join('?' * len(types))
+    query = f'SELECT id, nom, type FROM categories WHERE type IN ({placeholders}) ORDER BY id'
     
-    if result:
-        conn.close()
-        return result[0]
+    def load_ids(conn):
+        # En cas de doublons de casse, la plus ancienne catégorie l'emporte
+        ids = {}
+        for row in conn.execute(query, types):
+            ids.setdefault((nocase_key(row['nom']), row['type']), row['id'])
+        return ids
     
-    # Créer la catégorie si elle n'existe pas
-    try:
-        cursor = conn.execute(
-            'INSERT INTO categories (nom, type) VALUES (?, ?)',
-            (nom, cat_type)
-        )
-        conn.commit()
-        category_id = cursor.lastrowid
-        conn.close()
-        return category_id
-    except Exception: 
-        conn.close()
-        return None
\ No newline at end of file
+    with get_db() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            ids = load_ids(conn)
+            missing = {}
+            for nom, cat_type in pairs:
+                key = (nocase_key(nom), cat_type)
+                if key not in ids:
+                    missing.setdefault(key, (nom, cat_type))
+            if missing:
+                conn.executemany(
+                    'INSERT OR IGNORE INTO categories (nom, type) VALUES (?, ?)',
+                    list(missing.values())
+                )
+                ids = load_ids(conn)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    
+    return {
+        (nom, cat_type): ids.get((nocase_key(nom), cat_type))
+        for nom, cat_type in pairs
+    }
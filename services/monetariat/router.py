@@ -3,15 +3,25 @@
 Routes FastAPI pour Monétariat
 """
 
-from fastapi import APIRouter, Request, UploadFile, File, Depends, Form
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, RedirectResponse
+from fastapi import APIRouter, Request, UploadFile, File, Form
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, Response
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Optional
+import asyncio
 import csv
-import io
-from datetime import datetime
+import itertools
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+import orjson
+from cachetools import TTLCache
+from datetime import date, datetime
+from starlette.concurrency import run_in_threadpool
 
 from . import database as db
 from . import auth
@@ -20,9 +30,52 @@ from . import auth
 router = APIRouter()
 BASE_DIR = Path(__file__).parent.parent.parent
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
-
-# Initialiser la DB au démarrage
-db.init_db()
+# Templates compilés une seule fois : pas de vérification de modification
+templates.env.auto_reload = False
+templates.env.cache_size = 400
+
+# Pages statiques lues une seule fois au démarrage et servies depuis la mémoire
+PAGES_DIR = BASE_DIR / "templates" / "monetariat"
+PAGES = {
+    name: (PAGES_DIR / f"{name}.html").read_bytes()
+    for name in ("dashboard", "form", "settings", "import", "compte")
+}
+PAGE_HEADERS = {"cache-control": "private, max-age=60"}
+
+# Page de connexion : seules deux variantes existent, rendues une seule fois
+LOGIN_TEMPLATE = templates.get_template("monetariat/login.html")
+LOGIN_HTML = LOGIN_TEMPLATE.render()
+LOGIN_ERROR_HTML = LOGIN_TEMPLATE.render(error="Mot de passe incorrect")
+
+# Intervalle entre deux PRAGMA optimize (secondes)
+OPTIMIZE_INTERVAL = 6 * 3600
+
+_background_tasks = set()
+
+# Données de référence (comptes, catégories, modes de paiement, abonnements)
+# gardées déjà encodées en JSON, avec la version de la base qui les a produites
+REFERENCE_CACHE_TTL = 300
+_reference_cache = TTLCache(maxsize=64, ttl=REFERENCE_CACHE_TTL)
+_reference_cache_lock = threading.Lock()
+
+async def _optimize_loop():
+    """Rafraîchit périodiquement les statistiques SQLite"""
+    while True:
+        await asyncio.sleep(OPTIMIZE_INTERVAL)
+        await run_in_threadpool(db.optimize_db)
+
+async def startup():
+    """Démarrage du service (appelé par le lifespan de l'application)"""
+    await run_in_threadpool(db.init_db)
+    task = asyncio.create_task(_optimize_loop())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def shutdown():
+    """Arrêt du service (appelé par le lifespan de l'application)"""
+    for task in list(_background_tasks):
+        task.cancel()
+    db.close_db()
 
 # Models Pydantic
 class NewCategory(BaseModel):
@@ -30,6 +83,9 @@ class NewCategory(BaseModel):
     type: str
 
 class NewTransaction(BaseModel):
+    # Modèle de pydantic v2 (validation compilée), figé après validation
+    model_config = ConfigDict(frozen=True)
+    
     date: str
     compte_id: int
     montant: float
@@ -51,29 +107,19 @@ async def login_page(request: Request):
     if auth.check_authentication(request):
         return RedirectResponse(url="/monetariat/", status_code=302)
     
-    return templates.TemplateResponse(
-        "monetariat/login.html",
-        {"request": request}
-    )
+    return HTMLResponse(LOGIN_HTML)
 
 @router.post("/login")
 async def login(request: Request, password: str = Form(...)):
     """Traitement de la connexion"""
     # Vérifier le mot de passe
-    if auth.verify_password(password, auth.DEFAULT_PASSWORD_HASH):
+    if await auth.verify_password(password, auth.DEFAULT_PASSWORD_HASH_BYTES):
         # Créer la session
         request.session["authenticated"] = True
         return RedirectResponse(url="/monetariat/", status_code=302)
     else:
         # Mot de passe incorrect - retourner la page de login avec erreur
-        return templates.TemplateResponse(
-            "monetariat/login.html",
-            {
-                "request": request,
-                "error": "Mot de passe incorrect"
-            },
-            status_code=401
-        )
+        return HTMLResponse(LOGIN_ERROR_HTML, status_code=401)
 
 @router.get("/logout")
 async def logout(request: Request):
@@ -82,194 +128,340 @@ async def logout(request: Request):
     return RedirectResponse(url="/monetariat/login", status_code=302)
 
 # ============ PROTECTED ROUTES ============
+# Authentification vérifiée en amont par auth.AuthMiddleware (main.py)
 
 @router.get("/", response_class=HTMLResponse)
 async def monetariat_dashboard(request: Request):
     """Dashboard principal - Vue d'ensemble"""
-    # Vérifier l'authentification et rediriger si nécessaire
-    if not auth.check_authentication(request):
-        return RedirectResponse(url="/monetariat/login", status_code=302)
-    
-    html_path = BASE_DIR / "templates" / "monetariat" / "dashboard.html"
-    return FileResponse(html_path)
+    return HTMLResponse(PAGES["dashboard"], headers=PAGE_HEADERS)
 
 @router.get("/form", response_class=HTMLResponse)
 async def monetariat_form(request: Request):
     """Formulaire d'ajout de transaction"""
-    # Vérifier l'authentification et rediriger si nécessaire
-    if not auth.check_authentication(request):
-        return RedirectResponse(url="/monetariat/login", status_code=302)
-    
-    html_path = BASE_DIR / "templates" / "monetariat" / "form.html"
-    return FileResponse(html_path)
+    return HTMLResponse(PAGES["form"], headers=PAGE_HEADERS)
 
 @router.get("/settings", response_class=HTMLResponse)
 async def monetariat_settings(request: Request):
     """Page de paramètres des comptes"""
-    # Vérifier l'authentification et rediriger si nécessaire
-    if not auth.check_authentication(request):
-        return RedirectResponse(url="/monetariat/login", status_code=302)
-    
-    html_path = BASE_DIR / "templates" / "monetariat" / "settings.html"
-    return FileResponse(html_path)
+    return HTMLResponse(PAGES["settings"], headers=PAGE_HEADERS)
 
 @router.get("/import", response_class=HTMLResponse)
 async def monetariat_import(request: Request):
     """Page d'import CSV"""
-    # Vérifier l'authentification et rediriger si nécessaire
-    if not auth.check_authentication(request):
-        return RedirectResponse(url="/monetariat/login", status_code=302)
-    
-    html_path = BASE_DIR / "templates" / "monetariat" / "import.html"
-    return FileResponse(html_path)
+    return HTMLResponse(PAGES["import"], headers=PAGE_HEADERS)
 
 @router.get("/compte/{account_id}", response_class=HTMLResponse)
 async def monetariat_compte(request: Request, account_id: int):
     """Page des transactions d'un compte"""
-    # Vérifier l'authentification et rediriger si nécessaire
-    if not auth.check_authentication(request):
-        return RedirectResponse(url="/monetariat/login", status_code=302)
-    
-    html_path = BASE_DIR / "templates" / "monetariat" / "compte.html"
-    return FileResponse(html_path)
+    return HTMLResponse(PAGES["compte"], headers=PAGE_HEADERS)
 
 # API Routes
+# Handlers synchrones (def) : FastAPI les exécute dans son threadpool,
+# les appels SQLite ne bloquent donc pas la boucle d'événements
+def _cached_reference(key, loader, *args):
+    """Réponse JSON servie depuis le cache tant que reference_version n'a pas
+    changé (toute écriture, quel que soit le worker, l'incrémente par trigger)
+    """
+    version = db.get_reference_version()
+    with _reference_cache_lock:
+        cached = _reference_cache.get(key)
+    if cached is None or cached[0] != version:
+        cached = (version, orjson.dumps(loader(*args)))
+        with _reference_cache_lock:
+            _reference_cache[key] = cached
+    return Response(cached[1], media_type="application/json")
+
 @router.get("/api/accounts")
-async def api_get_accounts(_: None = Depends(auth.require_authentication)):
+def api_get_accounts():
     """Récupère tous les comptes"""
-    return db.get_all_accounts()
+    return _cached_reference('accounts', db.get_all_accounts)
 
 @router.get("/api/categories/{cat_type}")
-async def api_get_categories(cat_type: str, _: None = Depends(auth.require_authentication)):
+def api_get_categories(cat_type: str):
     """Récupère les catégories par type (depense/revenu) triées avec Autres à la fin"""
-    return db.get_categories_sorted(cat_type)
+    return _cached_reference(('categories', cat_type), db.get_categories_sorted, cat_type)
 
 @router.get("/api/payment-methods")
-async def api_get_payment_methods(_: None = Depends(auth.require_authentication)):
+def api_get_payment_methods():
     """Récupère tous les modes de paiement"""
-    return db.get_all_payment_methods()
+    return _cached_reference('payment_methods', db.get_all_payment_methods)
 
 @router.get("/api/subscriptions")
-async def api_get_subscriptions(_: None = Depends(auth.require_authentication)):
+def api_get_subscriptions():
     """Récupère tous les abonnements"""
-    return db.get_all_subscriptions()
+    return _cached_reference('subscriptions', db.get_all_subscriptions)
 
 @router.post("/api/categories")
-async def api_add_category(category: NewCategory, _: None = Depends(auth.require_authentication)):
+def api_add_category(category: NewCategory):
     """Ajoute une nouvelle catégorie"""
     result = db.add_category(category.nom, category.type)
     if result:
         return result
     else:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=400,
             content={"error":  "Catégorie déjà existante"}
         )
 
 @router.post("/api/subscriptions")
-async def api_add_subscription(data: dict, _: None = Depends(auth.require_authentication)):
+def api_add_subscription(data: dict):
     """Ajoute un nouvel abonnement"""
     result = db.add_subscription(data['nom'])
     if result:
         return result
     else:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=400,
             content={"error": "Abonnement déjà existant"}
         )
 
 @router.delete("/api/categories/{category_id}")
-async def api_delete_category(category_id:  int, _: None = Depends(auth.require_authentication)):
+def api_delete_category(category_id:  int):
     """Supprime une catégorie"""
     result = db.delete_category(category_id)
     if 'error' in result:
-        return JSONResponse(status_code=400, content=result)
+        return ORJSONResponse(status_code=400, content=result)
     return result
 
 @router.put("/api/categories/reorder")
-async def api_reorder_categories(data: dict, _: None = Depends(auth.require_authentication)):
+def api_reorder_categories(data: dict):
     """Réordonne les catégories
     Attend un dict avec 'orders':  [{'id': 1, 'ordre': 0}, {'id': 2, 'ordre': 1}, ...]
     """
     result = db.update_categories_order(data['orders'])
     if 'error' in result:
-        return JSONResponse(status_code=400, content=result)
+        return ORJSONResponse(status_code=400, content=result)
     return result
 
 @router.post("/api/transactions")
-async def api_add_transaction(transaction:  NewTransaction, _: None = Depends(auth.require_authentication)):
+def api_add_transaction(transaction:  NewTransaction):
     """Ajoute une nouvelle transaction"""
-    transaction_id = db.add_transaction(transaction.dict())
+    try:
+        transaction_id = db.add_transaction(transaction.model_dump())
+    except sqlite3.IntegrityError as e:
+        # Clés étrangères actives : compte, catégorie, mode de paiement ou
+        # abonnement inexistant
+        return ORJSONResponse(
+            status_code=400,
+            content={"error": f"Transaction invalide : {e}"}
+        )
     return {"id": transaction_id, "status": "success"}
 
 @router.get("/api/transactions")
-async def api_get_transactions(limit: int = 100, _: None = Depends(auth.require_authentication)):
+def api_get_transactions(limit: int = 100):
     """Récupère toutes les transactions"""
     return db.get_all_transactions(limit)
 
 @router.get("/api/accounts/summary")
-async def api_get_account_summary(_: None = Depends(auth.require_authentication)):
+def api_get_account_summary():
     """Récupère le résumé des comptes avec soldes calculés"""
     return db.get_account_summary()
 
 @router.put("/api/accounts/{account_id}/balance")
-async def api_update_account_balance(account_id:  int, data: dict, _: None = Depends(auth.require_authentication)):
+def api_update_account_balance(account_id:  int, data: dict):
     """Met à jour le solde d'un compte"""
     result = db.update_account_balance(account_id, data['balance'])
     if 'error' in result:
-        return JSONResponse(status_code=400, content=result)
+        return ORJSONResponse(status_code=400, content=result)
     return result
 
 @router.put("/api/accounts/{account_id}/name")
-async def api_update_account_name(account_id:  int, data: dict, _: None = Depends(auth.require_authentication)):
+def api_update_account_name(account_id:  int, data: dict):
     """Met à jour le nom d'un compte"""
     result = db.update_account_name(account_id, data['name'])
     if 'error' in result:
-        return JSONResponse(status_code=400, content=result)
+        return ORJSONResponse(status_code=400, content=result)
     return result
 
 # ============ ROUTES IMPORT CSV ============
 
+# Le fichier importé reste sur le serveur entre l'analyse et l'import :
+# le navigateur ne reçoit qu'un aperçu et un identifiant
+IMPORT_DIR = BASE_DIR / "databases" / "imports"
+# Fichiers analysés mais jamais importés, supprimés après ce délai (secondes)
+IMPORT_TTL = 24 * 3600
+IMPORT_PREVIEW_ROWS = 10
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+def _upload_path(upload_id: str) -> Path:
+    """Chemin du fichier CSV associé à un identifiant d'import"""
+    if not UPLOAD_ID_PATTERN.fullmatch(upload_id):
+        raise ValueError("Identifiant d'import invalide")
+    return IMPORT_DIR / f"{upload_id}.csv"
+
+def _purge_stale_uploads():
+    """Supprime les fichiers d'import abandonnés (plus vieux que IMPORT_TTL)"""
+    IMPORT_DIR.mkdir(parents=True, exist_ok=True)
+    limit = time.time() - IMPORT_TTL
+    for path in IMPORT_DIR.glob('*.csv'):
+        try:
+            if path.stat().st_mtime < limit:
+                path.unlink()
+        except FileNotFoundError:
+            pass  # déjà supprimé (import exécuté par un autre worker)
+
+def _save_upload(source, path: Path):
+    """Copie le fichier reçu par blocs, sans le garder en mémoire"""
+    with open(path, 'wb') as out:
+        shutil.copyfileobj(source, out, UPLOAD_CHUNK_SIZE)
+
+def _open_csv(path: Path):
+    return open(path, newline='', encoding='utf-8', buffering=1 << 20)
+
+def _read_csv_summary(path: Path):
+    """Lit les colonnes, l'aperçu et le nombre de lignes du CSV en un passage
+    Seules les lignes de l'aperçu sont converties en dictionnaires
+    """
+    with _open_csv(path) as f:
+        reader = csv.DictReader(f)
+        preview = list(itertools.islice(reader, IMPORT_PREVIEW_ROWS))
+        columns = list(reader.fieldnames or [])
+        # Comptage sur le lecteur C sous-jacent (lignes vides ignorées,
+        # comme DictReader ; un champ entre guillemets peut contenir un saut de ligne)
+        total_rows = len(preview) + sum(1 for row in reader.reader if row)
+    return columns, preview, total_rows
+
+# Position de categorie_id dans les lignes d'import
+CATEGORY_COLUMN = db.TRANSACTION_COLUMNS.index('categorie_id')
+
+# Caractères retirés des montants ('1,234.56 $' -> '1234.56') en une seule passe
+AMOUNT_CLEANUP = str.maketrans('', '', '$, ')
+
+def _parse_amount(text):
+    """Convertit un montant du CSV en float, ou None s'il est vide ou invalide"""
+    try:
+        # float() ignore déjà les espaces (tabulations, etc.) en bordure
+        return float(text.translate(AMOUNT_CLEANUP))
+    except ValueError:
+        return None
+
+# Formats de date acceptés à l'import, par ordre de priorité
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d', '%-m/%-d/%Y', '%m/%d/%y')
+ISO_DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}')
+DATE_SNIFF_ROWS = 20
+
+def _detect_date_format(samples):
+    """Premier format qui convient à tous les échantillons
+    (les lignes d'un même CSV partagent le même format de date)
+    """
+    for date_format in DATE_FORMATS:
+        try:
+            for sample in samples:
+                datetime.strptime(sample, date_format)
+        except ValueError:
+            continue
+        return date_format
+    return None
+
+def _parse_date(date_str, date_formats):
+    """Convertit une date en YYYY-MM-DD, ou None si aucun format ne convient"""
+    # Cas courant : déjà au format ISO, pas besoin de strptime
+    if ISO_DATE_PATTERN.fullmatch(date_str):
+        try:
+            return date.fromisoformat(date_str).isoformat()
+        except ValueError:
+            pass
+    for date_format in date_formats:
+        try:
+            return datetime.strptime(date_str, date_format).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+def _iter_upload_records(path: Path):
+    """Parcourt le CSV importé sans tout charger en mémoire
+    Produit d'abord l'en-tête, puis chaque ligne non vide sous forme de liste
+    """
+    with _open_csv(path) as f:
+        reader = csv.reader(f)
+        yield next(reader, [])
+        for record in reader:
+            if record:
+                yield record
+
+def _field_getter(columns, name, default):
+    """Accès à une colonne, résolu une seule fois avant la boucle d'import
+    
+    Args:
+        columns: En-tête du CSV (lignes en listes), ou None si les lignes
+                 sont des dictionnaires (format "rows")
+        name: Nom de la colonne
+        default: Valeur si la colonne est absente
+    """
+    if columns is None:
+        return lambda row: row.get(name, default)
+    try:
+        index = columns.index(name)
+    except ValueError:
+        return lambda row: default
+    return lambda row: row[index] if index < len(row) else default
+
+def _amount_reader(columns, mapping):
+    """Lecture du montant d'une ligne, spécialisée une seule fois par import
+    
+    Le mode (une colonne ou CAD$ + USD$) et le taux sont fixés pour tout le
+    fichier : la fonction retournée ne teste plus la configuration à chaque
+    ligne. Elle retourne le montant signé, ou None si la ligne est à ignorer.
+    """
+    if not mapping.get('is_multi_currency', False):
+        # Mode simple (une seule colonne), ligne ignorée si invalide
+        get_montant = _field_getter(columns, mapping.get('montant'), '0')
+        return lambda row: _parse_amount(get_montant(row))
+    
+    # Mode CAD$ + USD$ (vide ou invalide = 0)
+    get_montant_cad = _field_getter(columns, 'CAD$', '0')
+    get_montant_usd = _field_getter(columns, 'USD$', '0')
+    taux_usd_cad = mapping.get('taux_usd_cad', 1.35)
+    
+    def read_multi_currency(row):
+        # Prendre CAD en priorité, sinon USD converti
+        montant_cad = _parse_amount(get_montant_cad(row)) or 0
+        if montant_cad != 0:
+            return montant_cad
+        montant_usd = _parse_amount(get_montant_usd(row)) or 0
+        if montant_usd != 0:
+            return montant_usd * taux_usd_cad
+        return None  # Ignorer si les deux sont à 0
+    
+    return read_multi_currency
+
 @router.post("/api/import/parse")
-async def api_parse_csv(file: UploadFile = File(...), _: None = Depends(auth.require_authentication)):
-    """Parse un fichier CSV et retourne un aperçu des données"""
+async def api_parse_csv(file: UploadFile = File(...)):
+    """Enregistre le fichier CSV et retourne un aperçu des données"""
+    upload_id = uuid.uuid4().hex
+    path = _upload_path(upload_id)
+    await run_in_threadpool(_purge_stale_uploads)
     try:
-        # Lire le contenu du fichier
-        contents = await file.read()
-        decoded = contents.decode('utf-8')
-        
-        # Parser le CSV
-        csv_reader = csv.DictReader(io.StringIO(decoded))
-        rows = list(csv_reader)
-        
-        if not rows:
-            return JSONResponse(
-                status_code=400,
-                content={"error":  "Le fichier CSV est vide"}
-            )
+        # Écriture sur disque hors de la boucle d'événements
+        await run_in_threadpool(_save_upload, file.file, path)
         
-        # Détecter les colonnes disponibles
-        columns = list(rows[0].keys())
-        
-        # Retourner un aperçu (max 10 lignes)
-        preview = rows[:10]
-        
-        return {
-            "success": True,
-            "columns": columns,
-            "preview": preview,
-            "total_rows": len(rows),
-            "all_data": rows  # Garder toutes les données pour l'import
-        }
+        columns, preview, total_rows = await run_in_threadpool(_read_csv_summary, path)
     
     except Exception as e: 
-        return JSONResponse(
+        path.unlink(missing_ok=True)
+        return ORJSONResponse(
             status_code=400,
             content={"error":  f"Erreur lors de la lecture du fichier: {str(e)}"}
         )
+    
+    if not preview:
+        path.unlink(missing_ok=True)
+        return ORJSONResponse(
+            status_code=400,
+            content={"error":  "Le fichier CSV est vide"}
+        )
+    
+    return {
+        "success": True,
+        "upload_id": upload_id,  # Référence du fichier pour l'import
+        "columns": columns,
+        "preview": preview,
+        "total_rows": total_rows
+    }
 
 @router.post("/api/import/execute")
-async def api_execute_import(data: dict, _: None = Depends(auth.require_authentication)):
+def api_execute_import(data: dict):
     """Exécute l'import des transactions depuis les données CSV mappées
     
     Attend:  
@@ -283,64 +475,67 @@ async def api_execute_import(data: dict, _: None = Depends(auth.require_authenti
             "montant": "Montant",
             "categorie":  "Catégorie"
         },
-        "rows": [...]
+        "upload_id": "..."  (fichier reçu par /api/import/parse)
     }
+    Les lignes peuvent aussi être envoyées directement dans "rows": [...]
     """
     try:
         compte_id = data['compte_id']
         transaction_type = data['type']
         mode_paiement_id = data.get('mode_paiement_id')
         mapping = data['mapping']
-        rows = data['rows']
         
-        transactions_to_import = []
+        upload_path = None
+        if data.get('upload_id'):
+            upload_path = _upload_path(data['upload_id'])
+            if not upload_path.exists():
+                return ORJSONResponse(
+                    status_code=400,
+                    content={"error": "Fichier d'import introuvable, veuillez le recharger"}
+                )
+            rows = _iter_upload_records(upload_path)
+            columns = next(rows)
+        else:
+            rows = data['rows']
+            columns = None
+        
+        # Colonnes résolues une seule fois (indexation directe des lignes CSV)
+        get_date = _field_getter(columns, mapping['date'], '')
+        get_description = _field_getter(columns, mapping.get('description', ''), '')
+        get_categorie = _field_getter(columns, mapping.get('categorie', ''), 'Autres')
+        read_amount = _amount_reader(columns, mapping)
+        auto_type = transaction_type == 'auto'
+        
+        # Détecter le format de date sur les premières lignes, puis l'essayer
+        # en premier (les autres formats ne servent qu'en cas d'échec)
+        rows = iter(rows)
+        head = list(itertools.islice(rows, DATE_SNIFF_ROWS))
+        rows = itertools.chain(head, rows)
+        date_samples = [sample for sample in ((get_date(row) or '').strip() for row in head) if sample]
+        detected_format = _detect_date_format(date_samples)
+        if detected_format:
+            date_formats = (detected_format,) + tuple(f for f in DATE_FORMATS if f != detected_format)
+        else:
+            date_formats = DATE_FORMATS
+        today = datetime.now().strftime('%Y-%m-%d')
+        
+        # Lignes dans l'ordre de db.TRANSACTION_COLUMNS, insérées telles quelles
+        rows_to_import = []
+        category_keys = []  # (nom, type) de chaque transaction, résolus après la boucle
         
         for row in rows:
             # Extraire les valeurs selon le mapping
-            date_str = row.get(mapping['date'], '')
-            description = row.get(mapping.get('description', ''), '')
-            categorie_nom = row.get(mapping.get('categorie', ''), 'Autres')
-            
-            # ========== GESTION DES MONTANTS ==========
-            is_multi_currency = mapping.get('is_multi_currency', False)
-            taux_usd_cad = mapping.get('taux_usd_cad', 1.35)
-            
-            if is_multi_currency:
-                # Mode CAD$ + USD$
-                montant_cad_str = row.get('CAD$', '0').replace('$', '').replace(',', '').replace(' ', '').strip()
-                montant_usd_str = row.get('USD$', '0').replace('$', '').replace(',', '').replace(' ', '').strip()
-                
-                try:
-                    montant_cad_float = float(montant_cad_str) if montant_cad_str else 0
-                except ValueError:
-                    montant_cad_float = 0
-                
-                try:
-                    montant_usd_float = float(montant_usd_str) if montant_usd_str else 0
-                except ValueError:
-                    montant_usd_float = 0
-                
-                # Prendre CAD en priorité, sinon USD converti
-                if montant_cad_float != 0:
-                    montant_final = montant_cad_float
-                elif montant_usd_float != 0:
-                    montant_final = montant_usd_float * taux_usd_cad
-                else:
-                    continue  # Ignorer si les deux sont à 0
-            else:
-                # Mode simple (une seule colonne)
-                montant_str = row.get(mapping['montant'], '0')
-                montant_str = montant_str.replace('$', '').replace(',', '').replace(' ', '').strip()
-                try:
-                    montant_final = float(montant_str)
-                except ValueError:
-                    continue
+            date_str = (get_date(row) or '').strip()
+            description = get_description(row)
+            categorie_nom = get_categorie(row)
             
-            # ========== FIN GESTION MONTANTS ==========
+            montant_final = read_amount(row)
+            if montant_final is None:
+                continue
             
             # Détecter le type si "auto"
             actual_type = transaction_type
-            if transaction_type == 'auto':  
+            if auto_type:
                 actual_type = 'depense' if montant_final < 0 else 'revenu'
             
             # Convertir en valeur absolue
@@ -350,51 +545,41 @@ async def api_execute_import(data: dict, _: None = Depends(auth.require_authenti
             if montant == 0:
                 continue
             
-            # Parser la date
-            try:
-                # Essayer différents formats de date
-                for date_format in ['%Y-%m-%d', '%d/%m/%Y', '%m/%d/%Y', '%Y/%m/%d', '%-m/%-d/%Y', '%m/%d/%y']:  
-                    try:
-                        date_obj = datetime.strptime(date_str.strip(), date_format)
-                        date_formatted = date_obj.strftime('%Y-%m-%d')
-                        break
-                    except ValueError:
-                        continue
-                else:
-                    date_formatted = datetime.now().strftime('%Y-%m-%d')
-            except Exception:
-                date_formatted = datetime.now().strftime('%Y-%m-%d')
-            
-            # Trouver ou créer la catégorie
-            if categorie_nom:  
-                categorie_id = db.find_or_create_category(categorie_nom, actual_type)
-            else:
-                categorie_id = None
-            
-            # Créer la transaction
-            transaction_data = {
-                'date': date_formatted,
-                'compte_id': compte_id,
-                'montant': montant,
-                'categorie_id': categorie_id,
-                'description': description,
-                'necessite':  None,
-                'necessity_level': 'Neutre' if actual_type == 'depense' else None,
-                'mode_paiement_id': mode_paiement_id,
-                'type': actual_type,
-                'compte_destination_id': None,
-                'subscription_id': None
-            }
+            # Parser la date (date du jour si aucun format ne convient)
+            date_formatted = _parse_date(date_str, date_formats) or today
             
-            transactions_to_import.append(transaction_data)
+            # Créer la transaction (catégorie résolue après la boucle)
+            rows_to_import.append([
+                date_formatted,
+                compte_id,
+                montant,
+                None,  # categorie_id
+                description,
+                None,  # necessite
+                'Neutre' if actual_type == 'depense' else None,  # necessity_level
+                mode_paiement_id,
+                actual_type,
+                None,  # compte_destination_id
+                None  # subscription_id
+            ])
+            category_keys.append((categorie_nom, actual_type) if categorie_nom else None)
+        
+        # Trouver ou créer toutes les catégories en une seule transaction
+        category_ids = db.resolve_categories(key for key in category_keys if key)
+        for row_to_import, key in zip(rows_to_import, category_keys):
+            if key:
+                row_to_import[CATEGORY_COLUMN] = category_ids[key]
+        
+        # Importer en masse (un seul executemany)
+        result = db.bulk_add_transaction_rows(rows_to_import)
         
-        # Importer en masse
-        result = db.bulk_add_transactions(transactions_to_import)
+        if upload_path is not None:
+            upload_path.unlink(missing_ok=True)
         
         return result
     
     except Exception as e: 
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=400,
             content={"error": f"Erreur lors de l'import: {str(e)}"}
         )
\ No newline at end of file
@@ -3,26 +3,316 @@
 Gestion de la base de données WiFi Monitor
 """
 
+import calendar
 import sqlite3
+import threading
 from pathlib import Path
 from datetime import datetime, timedelta
 
 # Configuration
 BASE_DIR = Path(__file__).parent.parent.parent
 DB_PATH = BASE_DIR / "databases" / "wifi.db"
+# Version du schéma (PRAGMA user_version), à incrémenter quand init_db() change
+SCHEMA_VERSION = 7
+# Requêtes préparées gardées en cache par connexion (une variante par période)
+STATEMENT_CACHE_SIZE = 256
+# Taille de page appliquée à la création (ne peut changer qu'hors mode WAL)
+PAGE_SIZE = 8192
+# Mesure en échec (panne), même expression que l'index partiel idx_down_events
+DOWN_CONDITION = "(status = 'timeout' OR packet_loss >= 50)"
+
+# Tables d'agrégats (table -> durée d'un intervalle en secondes), tenues à
+# jour par trigger à chaque insertion dans ping_stats. Elles gardent tout
+# l'historique : le scanner ne conserve que les dernières semaines de mesures
+# brutes (scanner.RETENTION_DAYS)
+ROLLUPS = {
+    'ping_rollup_5m': 5 * 60,
+    'ping_rollup_1h': 3600,
+    'ping_rollup_1d': 86400,
+}
+
+# Une connexion par thread, ouverte une seule fois puis réutilisée
+# (au plus une par thread du threadpool FastAPI). Toutes les connexions
+# ouvertes sont aussi référencées ici pour pouvoir les fermer à l'arrêt
+_local = threading.local()
+_connections = set()
+_connections_lock = threading.Lock()
+
+def configure_connection(conn):
+    """Applique les PRAGMA de performance à une connexion
+    Le mode WAL est persistant et activé une seule fois dans init_db()
+    """
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')  # 64 Mo
+    conn.execute('PRAGMA mmap_size=268435456')  # 256 Mo
+    conn.execute('PRAGMA busy_timeout=5000')  # le scanner peut écrire en même temps
+
+def to_epoch(dt):
+    """Convertit une date locale (naïve) en secondes epoch « locales »
+    Même référence que strftime('%s', timestamp) sur les dates stockées,
+    utilisée pour la colonne ts_epoch
+    """
+    return calendar.timegm(dt.timetuple())
+
+def cutoff_epoch(hours):
+    """Borne inférieure (ts_epoch) des X dernières heures"""
+    return to_epoch(datetime.now() - timedelta(hours=hours))
 
 def get_db_connection():
-    """Crée une connexion à la base de données"""
-    conn = sqlite3.connect(str(DB_PATH))
-    conn.row_factory = sqlite3.Row
+    """Retourne la connexion du thread courant (à ne pas fermer)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or conn not in _connections:
+        conn = sqlite3.connect(
+            str(DB_PATH),
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
+        conn.row_factory = sqlite3.Row
+        configure_connection(conn)
+        _local.conn = conn
+        with _connections_lock:
+            _connections.add(conn)
+    elif conn.in_transaction:
+        # Transaction laissée ouverte par un appel interrompu : repartir propre
+        conn.rollback()
     return conn
 
+def close_db():
+    """Ferme les connexions de tous les threads (arrêt de l'application)
+    Un thread qui relit la base ensuite rouvre simplement sa connexion
+    """
+    with _connections_lock:
+        connections = list(_connections)
+        _connections.clear()
+    for conn in connections:
+        conn.close()
+
+def _create_rollup(cursor, table, seconds):
+    """Crée une table d'agrégats par (intervalle, hôte), son trigger de mise à
+    jour et, si elle est vide, la remplit à partir des mesures existantes
+    
+    Les colonnes sont des sommes et des compteurs : les moyennes se recombinent
+    sur n'importe quel regroupement d'intervalles (SUM(sum_x) / SUM(n))
+    """
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            bucket INTEGER NOT NULL,
+            host TEXT NOT NULL,
+            samples INTEGER NOT NULL,
+            latency_samples INTEGER NOT NULL,
+            sum_latency REAL NOT NULL,
+            min_latency REAL,
+            max_latency REAL,
+            sum_loss REAL NOT NULL,
+            reachable INTEGER NOT NULL,
+            lost INTEGER NOT NULL,
+            timeouts INTEGER NOT NULL,
+            PRIMARY KEY (bucket, host)
+        ) WITHOUT ROWID
+    ''')
+    
+    # ts_epoch peut encore être NULL ici (renseigné par trg_ping_stats_epoch)
+    epoch = "COALESCE(NEW.ts_epoch, CAST(strftime('%s', NEW.timestamp) AS INTEGER))"
+    # MIN/MAX scalaires renvoient NULL si un argument est NULL
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}
+        AFTER INSERT ON ping_stats
+        BEGIN
+            INSERT INTO {table} (
+                bucket, host, samples, latency_samples, sum_latency,
+                min_latency, max_latency, sum_loss, reachable, lost, timeouts
+            )
+            VALUES (
+                {epoch} - {epoch} % {seconds},
+                NEW.host,
+                1,
+                NEW.avg_latency IS NOT NULL,
+                COALESCE(NEW.avg_latency, 0),
+                NEW.min_latency,
+                NEW.max_latency,
+                NEW.packet_loss,
+                NEW.packet_loss < 100,
+                NEW.packet_loss = 100,
+                NEW.status = 'timeout'
+            )
+            ON CONFLICT (bucket, host) DO UPDATE SET
+                samples = samples + 1,
+                latency_samples = latency_samples + excluded.latency_samples,
+                sum_latency = sum_latency + excluded.sum_latency,
+                min_latency = COALESCE(MIN(min_latency, excluded.min_latency), min_latency, excluded.min_latency),
+                max_latency = COALESCE(MAX(max_latency, excluded.max_latency), max_latency, excluded.max_latency),
+                sum_loss = sum_loss + excluded.sum_loss,
+                reachable = reachable + excluded.reachable,
+                lost = lost + excluded.lost,
+                timeouts = timeouts + excluded.timeouts;
+        END
+    ''')
+    
+    if cursor.execute(f'SELECT 1 FROM {table} LIMIT 1').fetchone() is None:
+        cursor.execute(f'''
+            INSERT INTO {table}
+            SELECT
+                ts_epoch - ts_epoch % {seconds},
+                host,
+                COUNT(*),
+                COUNT(avg_latency),
+                TOTAL(avg_latency),
+                MIN(min_latency),
+                MAX(max_latency),
+                TOTAL(packet_loss),
+                SUM(packet_loss < 100),
+                SUM(packet_loss = 100),
+                SUM(status = 'timeout')
+            FROM ping_stats
+            GROUP BY 1, 2
+        ''')
+
+def _pick_rollup(interval_seconds):
+    """Table d'agrégats la plus grossière dont l'intervalle divise exactement
+    interval_seconds (chaque regroupement couvre alors des intervalles entiers),
+    ou None s'il faut lire les mesures brutes
+    """
+    best = None
+    for table, seconds in ROLLUPS.items():
+        if interval_seconds % seconds == 0 and (best is None or seconds > best[1]):
+            best = (table, seconds)
+    return best
+
+def _measures_sql(rollup, start, end=None):
+    """Sous-requête des mesures de la fenêtre [start, end] (epochs inclus,
+    end=None : jusqu'à maintenant), au format des tables d'agrégats
+    
+    Les intervalles complets sont lus dans la table d'agrégats, seuls les bords
+    partiels de la fenêtre viennent de ping_stats. Colonnes : epoch, host,
+    samples, latency_samples, sum_latency, min_latency, max_latency, sum_loss,
+    reachable, lost, timeouts
+    
+    Returns:
+        (sql, params) à utiliser dans un WITH ... AS (sql)
+    """
+    raw = '''
+        SELECT
+            ts_epoch, host, 1, avg_latency IS NOT NULL, COALESCE(avg_latency, 0),
+            min_latency, max_latency, packet_loss,
+            packet_loss < 100, packet_loss = 100, status = 'timeout'
+        FROM ping_stats
+        WHERE ts_epoch >= ? AND ts_epoch < ?
+    '''
+    if rollup is None:
+        return raw, (start, end + 1 if end is not None else 2 ** 62)
+    
+    table, seconds = rollup
+    # Premier intervalle entièrement compris dans la fenêtre
+    first_full = start + (-start) % seconds
+    sql = f'''
+        SELECT
+            bucket, host, samples, latency_samples, sum_latency,
+            min_latency, max_latency, sum_loss, reachable, lost, timeouts
+        FROM {table}
+        WHERE bucket >= ?{' AND bucket < ?' if end is not None else ''}
+        UNION ALL{raw}'''
+    if end is None:
+        return sql, (first_full, start, first_full)
+    
+    # Fin du dernier intervalle complet (jamais avant first_full)
+    last_full = max(first_full, (end + 1) - (end + 1) % seconds)
+    return f'''{sql}
+        UNION ALL{raw}''', (
+        first_full, last_full,
+        start, min(first_full, end + 1),
+        last_full, end + 1
+    )
+
+def _aggregated_history(interval_minutes, start, end=None):
+    """Historique regroupé par intervalle de interval_minutes sur [start, end]"""
+    interval = interval_minutes * 60
+    measures, params = _measures_sql(_pick_rollup(interval), start, end)
+    # L'intervalle est un paramètre lié : une seule requête préparée par
+    # table source, quelle que soit la période demandée
+    
+    # Arrondis et statut calculés par SQLite (0 si moyenne nulle ou absente)
+    cursor = get_db_connection().execute(f"""
+        WITH measures (
+            epoch, host, samples, latency_samples, sum_latency,
+            min_latency, max_latency, sum_loss, reachable, lost, timeouts
+        ) AS ({measures})
+        SELECT
+            time_bucket,
+            host,
+            CASE WHEN avg_latency THEN ROUND(avg_latency, 3) ELSE 0 END as avg_latency,
+            CASE WHEN packet_loss THEN ROUND(packet_loss, 1) ELSE 0 END as packet_loss,
+            CASE WHEN timeout_rate > 0.5 THEN 'timeout' ELSE 'success' END as status
+        FROM (
+            SELECT
+                datetime(epoch - (epoch % ?), 'unixepoch') as time_bucket,
+                host,
+                TOTAL(sum_latency) / SUM(latency_samples) as avg_latency,
+                TOTAL(sum_loss) / SUM(samples) as packet_loss,
+                1.0 * SUM(timeouts) / SUM(samples) as timeout_rate
+            FROM measures
+            GROUP BY time_bucket, host
+        )
+        ORDER BY time_bucket ASC, host
+    """, params + (interval,))
+    
+    return [
+        {
+            'timestamp': row['time_bucket'],
+            'host': row['host'],
+            'avg_latency': row['avg_latency'],
+            'packet_loss': row['packet_loss'],
+            'status': row['status']
+        }
+        for row in cursor
+    ]
+
+_initialized = False
+
+def is_db_initialized():
+    """Vérifie (connexion en lecture seule) que le schéma courant est en place"""
+    if not DB_PATH.exists():
+        return False
+    conn = sqlite3.connect(f'{DB_PATH.resolve().as_uri()}?mode=ro', uri=True)
+    try:
+        return conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
 def init_db():
-    """Initialise la base de données si elle n'existe pas"""
+    """Initialise la base de données (une seule fois par processus,
+    et sans rien réécrire si le schéma est déjà à jour)
+    """
+    global _initialized
+    if _initialized or is_db_initialized():
+        _initialized = True
+        return
+    
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
     
     conn = sqlite3.connect(str(DB_PATH))
+    # page_size ne peut être modifié qu'en dehors du mode WAL, auto_vacuum
+    # (pages libérées par la rétention du scanner rendues au système par
+    # PRAGMA incremental_vacuum) : VACUUM requis si la base existe déjà
+    needs_vacuum = False
+    if conn.execute('PRAGMA page_size').fetchone()[0] != PAGE_SIZE:
+        conn.execute('PRAGMA journal_mode=DELETE')
+        conn.execute(f'PRAGMA page_size={PAGE_SIZE}')
+        needs_vacuum = True
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:  # INCREMENTAL
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        needs_vacuum = True
+    if needs_vacuum:
+        conn.execute('VACUUM')
+    # WAL : les lectures du dashboard ne bloquent plus les écritures du scanner
+    conn.execute('PRAGMA journal_mode=WAL')
+    configure_connection(conn)
     cursor = conn.cursor()
+    # Schéma et remplissage des agrégats en une seule transaction : aucune
+    # mesure du scanner ne peut être comptée deux fois (trigger + remplissage)
+    cursor.execute('BEGIN IMMEDIATE')
     
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS ping_stats (
@@ -35,99 +325,185 @@ def init_db():
             packet_loss REAL NOT NULL,
             packets_transmitted INTEGER,
             packets_received INTEGER,
-            status TEXT NOT NULL
+            status TEXT NOT NULL,
+            ts_epoch INTEGER
         )
     ''')
     
+    # Migration : horodatage entier (comparaisons et regroupements sans
+    # conversion de texte)
+    columns = [row[1] for row in cursor.execute('PRAGMA table_info(ping_stats)')]
+    if 'ts_epoch' not in columns:
+        cursor.execute('ALTER TABLE ping_stats ADD COLUMN ts_epoch INTEGER')
+        cursor.execute("UPDATE ping_stats SET ts_epoch = strftime('%s', timestamp)")
+    
+    # Renseigne ts_epoch pour les écritures qui ne le fournissent pas
     cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_timestamp 
-        ON ping_stats(timestamp)
+        CREATE TRIGGER IF NOT EXISTS trg_ping_stats_epoch
+        AFTER INSERT ON ping_stats
+        WHEN NEW.ts_epoch IS NULL
+        BEGIN
+            UPDATE ping_stats SET ts_epoch = strftime('%s', NEW.timestamp)
+            WHERE id = NEW.id;
+        END
     ''')
     
+    # Les requêtes filtrent toutes sur ts_epoch : les index texte ne servent plus
+    cursor.execute('DROP INDEX IF EXISTS idx_timestamp')
+    cursor.execute('DROP INDEX IF EXISTS idx_host')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ts_epoch
+        ON ping_stats(ts_epoch)
+    ''')
+    
+    # Index couvrant par hôte puis par date : les recherches des pannes
+    # (mesure précédente / suivante d'un hôte) et les statistiques par hôte
+    # sont lues dans l'ordre de l'index, sans accès à la table ni tri
+    cursor.execute('DROP INDEX IF EXISTS idx_host_ts')
     cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_host 
-        ON ping_stats(host)
+        CREATE INDEX IF NOT EXISTS idx_host_ts_cover
+        ON ping_stats(host, ts_epoch, status, packet_loss, avg_latency,
+                      min_latency, max_latency, timestamp)
     ''')
     
+    # Index partiel des seules mesures en échec (rares) : point de départ de
+    # la détection des pannes
+    cursor.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_down_events
+        ON ping_stats(ts_epoch, host)
+        WHERE {DOWN_CONDITION}
+    ''')
+    
+    for table, seconds in ROLLUPS.items():
+        _create_rollup(cursor, table, seconds)
+    
+    cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
     conn.commit()
+    
+    # Statistiques du planificateur : sans elles, SQLite ne parcourt pas
+    # l'index couvrant hôte par hôte (skip-scan)
+    has_stats = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+    ).fetchone()
+    if not has_stats:
+        cursor.execute('ANALYZE')
+    cursor.execute('PRAGMA optimize')
+    
     conn.close()
+    _initialized = True
 
 def get_latest_stats(hours=24):
     """
     Récupère les statistiques AGRÉGÉES par hôte (dernières X heures)
     Retourne 1 entrée par hôte avec moyennes calculées + uptime
+    
+    Les intervalles complets viennent de ping_rollup_1h, dont les compteurs
+    (reachable, lost) sont tenus à jour par trigger : quelques dizaines de
+    lignes par hôte au lieu d'une par mesure. Seul le début de la fenêtre
+    (moins d'une heure) est lu dans ping_stats.
+    
+    last_seen est l'heure de la dernière mesure brute de l'hôte ; si elles ont
+    toutes été supprimées (rétention du scanner), c'est le début du dernier
+    intervalle d'agrégat de la fenêtre
     """
     conn = get_db_connection()
-    cutoff = datetime.now() - timedelta(hours=hours)
+    rollup = ('ping_rollup_1h', ROLLUPS['ping_rollup_1h'])
+    measures, params = _measures_sql(rollup, cutoff_epoch(hours) + 1)
     
-    cursor = conn.execute("""
-        SELECT 
+    cursor = conn.execute(f"""
+        WITH measures (
+            epoch, host, samples, latency_samples, sum_latency,
+            min_latency, max_latency, sum_loss, reachable, lost, timeouts
+        ) AS ({measures})
+        SELECT
             host,
-            AVG(avg_latency) as avg_latency,
-            MIN(min_latency) as min_latency,
-            MAX(max_latency) as max_latency,
-            AVG(packet_loss) as packet_loss,
-            COUNT(*) as sample_count,
-            MAX(timestamp) as last_seen,
+            -- Arrondis faits par SQLite (NULL / 0 si la valeur est nulle ou absente)
+            CASE WHEN avg_latency THEN ROUND(avg_latency, 3) END as avg_latency,
+            CASE WHEN min_latency THEN ROUND(min_latency, 3) END as min_latency,
+            CASE WHEN max_latency THEN ROUND(max_latency, 3) END as max_latency,
+            CASE WHEN packet_loss THEN ROUND(packet_loss, 2) ELSE 0 END as packet_loss,
+            sample_count,
+            -- Dernière mesure de l'hôte (index couvrant, une seule ligne lue),
+            -- sinon dernier intervalle d'agrégat
+            COALESCE(
+                (
+                    SELECT timestamp
+                    FROM ping_stats p
+                    WHERE p.host = h.host
+                    ORDER BY p.ts_epoch DESC
+                    LIMIT 1
+                ),
+                datetime(last_epoch, 'unixepoch')
+            ) as last_seen,
             -- Calcul de l'uptime :  % de mesures avec packet_loss < 100%
-            ROUND(100.0 * SUM(CASE WHEN packet_loss < 100 THEN 1 ELSE 0 END) / COUNT(*), 2) as uptime_percent,
+            ROUND(100.0 * reachable / sample_count, 2) as uptime_percent,
             -- Total de paquets perdus
-            SUM(CASE WHEN packet_loss = 100 THEN 1 ELSE 0 END) as total_outages
-        FROM ping_stats
-        WHERE timestamp > ?
-        GROUP BY host
+            total_outages
+        FROM (
+            SELECT
+                host,
+                TOTAL(sum_latency) / SUM(latency_samples) as avg_latency,
+                MIN(min_latency) as min_latency,
+                MAX(max_latency) as max_latency,
+                TOTAL(sum_loss) / SUM(samples) as packet_loss,
+                SUM(samples) as sample_count,
+                SUM(reachable) as reachable,
+                SUM(lost) as total_outages,
+                MAX(epoch) as last_epoch
+            FROM measures
+            GROUP BY host
+        ) h
         ORDER BY host
-    """, (cutoff.strftime('%Y-%m-%d %H:%M:%S'),))
+    """, params)
     
-    stats = []
-    for row in cursor.fetchall():
-        stats.append({
+    return [
+        {
             'host': row['host'],
-            'avg_latency': round(row['avg_latency'], 3) if row['avg_latency'] else None,
-            'min_latency': round(row['min_latency'], 3) if row['min_latency'] else None,
-            'max_latency':  round(row['max_latency'], 3) if row['max_latency'] else None,
-            'packet_loss': round(row['packet_loss'], 2) if row['packet_loss'] else 0,
+            'avg_latency': row['avg_latency'],
+            'min_latency': row['min_latency'],
+            'max_latency': row['max_latency'],
+            'packet_loss': row['packet_loss'],
             'uptime_percent': row['uptime_percent'],
             'total_outages': row['total_outages'],
             'sample_count': row['sample_count'],
             'last_seen':  row['last_seen']
-        })
-    
-    conn.close()
-    return stats
+        }
+        for row in cursor
+    ]
 
-def get_history(hours=24):
+# Requête construite une seule fois : le texte SQL identique à chaque appel
+# est retrouvé dans le cache de requêtes préparées de la connexion
+HISTORY_JSON_SQL = '''
+    SELECT json_group_array(json_object(
+        'timestamp', timestamp,
+        'host', host,
+        'avg_latency', CASE WHEN avg_latency THEN ROUND(avg_latency, 3) ELSE 0 END,
+        'packet_loss', CASE WHEN packet_loss THEN ROUND(packet_loss, 1) ELSE 0 END,
+        'status', status
+    ))
+    FROM (
+        SELECT timestamp, host, avg_latency, packet_loss, status
+        FROM ping_stats
+        WHERE ts_epoch > ?
+        ORDER BY ts_epoch ASC
+    )
+'''
+
+def get_history_json(hours=24):
     """
     Récupère l'historique DÉTAILLÉ des pings (non agrégé)
     Pour tracer les graphiques
+    
+    Le tableau JSON est construit directement par SQLite (json_group_array) :
+    aucun dict Python par mesure, la chaîne est renvoyée telle quelle au client
     """
     conn = get_db_connection()
-    cutoff = datetime.now() - timedelta(hours=hours)
-    
-    cursor = conn.execute("""
-        SELECT 
-            timestamp,
-            host,
-            avg_latency,
-            packet_loss,
-            status
-        FROM ping_stats
-        WHERE timestamp > ?
-        ORDER BY timestamp ASC
-    """, (cutoff.strftime('%Y-%m-%d %H:%M:%S'),))
+    cutoff = cutoff_epoch(hours)
     
-    history = []
-    for row in cursor.fetchall():
-        history.append({
-            'timestamp': row['timestamp'],
-            'host': row['host'],
-            'avg_latency': round(row['avg_latency'], 3) if row['avg_latency'] else 0,
-            'packet_loss':  round(row['packet_loss'], 1) if row['packet_loss'] else 0,
-            'status': row['status']
-        })
+    cursor = conn.execute(HISTORY_JSON_SQL, (cutoff,))
     
-    conn.close()
-    return history
+    return cursor.fetchone()[0]
 
 def get_aggregated_history(hours=24, interval_minutes=60):
     """
@@ -141,45 +517,20 @@ def get_aggregated_history(hours=24, interval_minutes=60):
     Returns:
         Liste de données agrégées (moyennes par intervalle)
     """
-    conn = get_db_connection()
-    cutoff = datetime.now() - timedelta(hours=hours)
-    
-    # Conversion interval_minutes en format SQLite
-    # On arrondit les timestamps à l'intervalle le plus proche
-    cursor = conn.execute(f"""
-        SELECT 
-            datetime(
-                strftime('%s', timestamp) - (strftime('%s', timestamp) % ({interval_minutes} * 60)),
-                'unixepoch'
-            ) as time_bucket,
-            host,
-            AVG(avg_latency) as avg_latency,
-            AVG(packet_loss) as packet_loss,
-            AVG(CASE WHEN status = 'timeout' THEN 1 ELSE 0 END) as timeout_rate
-        FROM ping_stats
-        WHERE timestamp > ?
-        GROUP BY time_bucket, host
-        ORDER BY time_bucket ASC
-    """, (cutoff.strftime('%Y-%m-%d %H:%M:%S'),))
-    
-    history = []
-    for row in cursor.fetchall():
-        history.append({
-            'timestamp': row['time_bucket'],
-            'host': row['host'],
-            'avg_latency':  round(row['avg_latency'], 3) if row['avg_latency'] else 0,
-            'packet_loss': round(row['packet_loss'], 1) if row['packet_loss'] else 0,
-            'status': 'timeout' if row['timeout_rate'] > 0.5 else 'success'
-        })
-    
-    conn.close()
-    return history
+    # Les timestamps sont arrondis à l'intervalle ; les tables d'agrégats
+    # fournissent les intervalles complets
+    return _aggregated_history(interval_minutes, cutoff_epoch(hours) + 1)
 
 def get_custom_period_history(start_date, end_date, max_points=30):
     """
     Récupère l'historique pour une période personnalisée
     Calcule automatiquement l'intervalle pour limiter à max_points
     
+    Si la période commence avant la plus ancienne mesure brute conservée
+    (rétention du scanner), l'intervalle est arrondi au multiple supérieur
+    de l'intervalle des agrégats les plus fins (5 min) : chaque point est
+    alors lu dans les agrégats, sans dépasser max_points
+    
     Args:
         start_date: Date de début (format:  'YYYY-MM-DD HH:MM:SS')
         end_date: Date de fin (format: 'YYYY-MM-DD HH:MM:SS')
@@ -188,8 +539,6 @@ def get_custom_period_history(start_date, end_date, max_points=30):
     Returns: 
         Liste de données agrégées
     """
-    conn = get_db_connection()
-    
     # Calculer la durée totale en minutes
     start_dt = datetime.strptime(start_date, '%Y-%m-%d %H:%M:%S')
     end_dt = datetime.strptime(end_date, '%Y-%m-%d %H:%M:%S')
@@ -197,52 +546,40 @@ def get_custom_period_history(start_date, end_date, max_points=30):
     
     # Calculer l'intervalle pour avoir environ max_points
     interval_minutes = max(1, total_minutes // max_points)
+    start_epoch = to_epoch(start_dt)
     
-    cursor = conn.execute(f"""
-        SELECT 
-            datetime(
-                strftime('%s', timestamp) - (strftime('%s', timestamp) % ({interval_minutes} * 60)),
-                'unixepoch'
-            ) as time_bucket,
-            host,
-            AVG(avg_latency) as avg_latency,
-            AVG(packet_loss) as packet_loss,
-            AVG(CASE WHEN status = 'timeout' THEN 1 ELSE 0 END) as timeout_rate
-        FROM ping_stats
-        WHERE timestamp BETWEEN ? AND ?
-        GROUP BY time_bucket, host
-        ORDER BY time_bucket ASC
-    """, (start_date, end_date))
-    
-    history = []
-    for row in cursor.fetchall():
-        history.append({
-            'timestamp': row['time_bucket'],
-            'host': row['host'],
-            'avg_latency':  round(row['avg_latency'], 3) if row['avg_latency'] else 0,
-            'packet_loss': round(row['packet_loss'], 1) if row['packet_loss'] else 0,
-            'status': 'timeout' if row['timeout_rate'] > 0.5 else 'success'
-        })
-    
-    conn.close()
-    return history
+    # Mesures brutes supprimées par la rétention : des intervalles entiers
+    # d'agrégats couvrent la période
+    oldest = get_db_connection().execute('SELECT MIN(ts_epoch) FROM ping_stats').fetchone()[0]
+    if oldest is not None and start_epoch < oldest:
+        step = min(ROLLUPS.values()) // 60
+        interval_minutes = -(-interval_minutes // step) * step
     
+    return _aggregated_history(interval_minutes, start_epoch, to_epoch(end_dt))
+
 def get_summary_stats(hours=24):
-    """Récupère un résumé des statistiques"""
+    """Récupère un résumé des statistiques
+    
+    Les intervalles complets viennent de ping_rollup_5m ; seul le début de la
+    fenêtre (moins de 5 minutes) est lu dans les mesures brutes
+    """
     conn = get_db_connection()
-    cutoff = datetime.now() - timedelta(hours=hours)
+    rollup = ('ping_rollup_5m', ROLLUPS['ping_rollup_5m'])
+    measures, params = _measures_sql(rollup, cutoff_epoch(hours) + 1)
     
-    cursor = conn.execute("""
-        SELECT 
+    cursor = conn.execute(f"""
+        WITH measures (
+            epoch, host, samples, latency_samples, sum_latency,
+            min_latency, max_latency, sum_loss, reachable, lost, timeouts
+        ) AS ({measures})
+        SELECT
             COUNT(DISTINCT host) as host_count,
-            AVG(avg_latency) as overall_avg_latency,
-            AVG(packet_loss) as overall_packet_loss
-        FROM ping_stats
-        WHERE timestamp > ?
-    """, (cutoff.strftime('%Y-%m-%d %H:%M:%S'),))
+            TOTAL(sum_latency) / SUM(latency_samples) as overall_avg_latency,
+            TOTAL(sum_loss) / SUM(samples) as overall_packet_loss
+        FROM measures
+    """, params)
     
     row = cursor.fetchone()
-    conn.close()
     
     return {
         'host_count': row['host_count'],
@@ -250,76 +587,102 @@ def get_summary_stats(hours=24):
         'overall_packet_loss': round(row['overall_packet_loss'], 2) if row['overall_packet_loss'] else 0
     }
 
+def format_duration(seconds):
+    """Formate une durée en secondes (ex: '1h 2m 3s', '4m 5s', '6s')"""
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours > 0:
+        return f"{hours}h {minutes}m {seconds}s"
+    if minutes > 0:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
+
+OUTAGES_SQL = f'''
+    WITH down AS (
+        SELECT host, timestamp, ts_epoch
+        FROM ping_stats
+        WHERE {DOWN_CONDITION} AND ts_epoch > :cutoff
+    ),
+    -- Début de panne : mesure en échec dont la précédente (dans la
+    -- fenêtre) est réussie ou absente
+    starts AS (
+        SELECT host, timestamp AS start, ts_epoch AS start_epoch
+        FROM down d
+        WHERE NOT COALESCE((
+            SELECT {DOWN_CONDITION}
+            FROM ping_stats p
+            WHERE p.host = d.host AND p.ts_epoch > :cutoff AND p.ts_epoch < d.ts_epoch
+            ORDER BY p.ts_epoch DESC
+            LIMIT 1
+        ), 0)
+    ),
+    -- Fin de panne : première mesure réussie qui suit (NULL si en cours)
+    periods AS (
+        SELECT
+            host,
+            start,
+            start_epoch,
+            (
+                SELECT ts_epoch
+                FROM ping_stats p
+                WHERE p.host = s.host AND p.ts_epoch > s.start_epoch AND NOT {DOWN_CONDITION}
+                ORDER BY p.ts_epoch
+                LIMIT 1
+            ) AS end_epoch
+        FROM starts s
+    )
+    SELECT
+        host,
+        start,
+        (
+            SELECT timestamp
+            FROM ping_stats p
+            WHERE p.host = periods.host AND p.ts_epoch = periods.end_epoch
+        ) AS end,
+        end_epoch - start_epoch AS duration_seconds
+    FROM periods
+    -- Pannes terminées (par date de fin) puis pannes en cours
+    ORDER BY end_epoch IS NULL, COALESCE(end_epoch, start_epoch)
+'''
+
 def get_outages(hours=24):
     """
     Détecte et regroupe les pannes de connexion
     Retourne des périodes de panne avec début, fin et durée
+    
+    Une panne (perte de paquets >= 50% ou status = 'timeout') commence à la
+    première mesure en échec d'un hôte et se termine à sa mesure réussie
+    suivante. Seules les mesures en échec sont parcourues (index partiel
+    idx_down_events) ; la mesure précédente et la fin de chaque panne sont
+    des recherches ponctuelles dans idx_host_ts_cover.
     """
     conn = get_db_connection()
-    cutoff = datetime.now() - timedelta(hours=hours)
+    cutoff = cutoff_epoch(hours)
     
-    # Récupérer tous les pings
-    cursor = conn.execute("""
-        SELECT timestamp, host, status, packet_loss
-        FROM ping_stats
-        WHERE timestamp > ?
-        ORDER BY timestamp ASC
-    """, (cutoff.strftime('%Y-%m-%d %H:%M:%S'),))
-    
-    results = cursor.fetchall()
-    conn.close()
+    cursor = conn.execute(OUTAGES_SQL, {'cutoff': cutoff})
     
-    # Détecter les pannes (perte de paquets > 50% ou status = 'timeout')
     outages = []
-    current_outage = {}
-    
-    for row in results:
-        is_down = row['status'] == 'timeout' or (row['packet_loss'] and row['packet_loss'] >= 50)
-        host = row['host']
+    for row in cursor.fetchall():
+        if row['end'] is None:
+            outages.append({
+                'host': row['host'],
+                'start': row['start'],
+                'end': 'En cours',
+                'duration': 'En cours',
+                'status': 'ongoing'
+            })
+            continue
         
-        if is_down:
-            if host not in current_outage: 
-                # Début d'une nouvelle panne pour cet hôte
-                current_outage[host] = {
-                    'host': host,
-                    'start': row['timestamp'],
-                    'end': None,
-                    'duration': None,
-                    'status': 'ongoing'
-                }
-        else:
-            if host in current_outage: 
-                # Fin de la panne pour cet hôte
-                current_outage[host]['end'] = row['timestamp']
-                current_outage[host]['status'] = 'resolved'
-                
-                # Calculer la durée
-                try:
-                    start_dt = datetime.strptime(current_outage[host]['start'], '%Y-%m-%d %H:%M:%S')
-                    end_dt = datetime.strptime(current_outage[host]['end'], '%Y-%m-%d %H:%M:%S')
-                    duration = end_dt - start_dt
-                    current_outage[host]['duration_seconds'] = int(duration.total_seconds())
-                    
-                    # Format durée lisible
-                    minutes, seconds = divmod(int(duration.total_seconds()), 60)
-                    hours_dur, minutes = divmod(minutes, 60)
-                    if hours_dur > 0:
-                        current_outage[host]['duration'] = f"{hours_dur}h {minutes}m {seconds}s"
-                    elif minutes > 0:
-                        current_outage[host]['duration'] = f"{minutes}m {seconds}s"
-                    else:
-                        current_outage[host]['duration'] = f"{seconds}s"
-                except: 
-                    current_outage[host]['duration'] = 'Unknown'
-                
-                outages.append(current_outage[host])
-                del current_outage[host]
-    
-    # Pannes toujours en cours
-    for host, outage in current_outage.items():
-        outage['end'] = 'En cours'
-        outage['duration'] = 'En cours'
-        outage['status'] = 'ongoing'
+        outage = {
+            'host': row['host'],
+            'start': row['start'],
+            'end': row['end'],
+            'duration': 'Unknown',
+            'status': 'resolved'
+        }
+        if row['duration_seconds'] is not None:
+            outage['duration_seconds'] = int(row['duration_seconds'])
+            outage['duration'] = format_duration(outage['duration_seconds'])
         outages.append(outage)
     
-    return outages
\ No newline at end of file
+    return outages
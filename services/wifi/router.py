@@ -3,8 +3,14 @@
 Routes FastAPI pour le WiFi Monitor
 """
 
+import functools
+import gzip
+import threading
+
+from cachetools import TTLCache
 from fastapi import APIRouter, Request
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, ORJSONResponse, Response
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
 
@@ -15,25 +21,80 @@ router = APIRouter()
 BASE_DIR = Path(__file__).parent.parent.parent
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 
-# Initialiser la DB au démarrage
-db.init_db()
+# Dashboard statique lu une seule fois et servi depuis la mémoire,
+# avec une version compressée une fois pour toutes
+DASHBOARD_HTML = (BASE_DIR / "templates" / "wifi" / "dashboard.html").read_bytes()
+DASHBOARD_GZIP = gzip.compress(DASHBOARD_HTML, 9)
+DASHBOARD_HEADERS = {"cache-control": "public, max-age=60", "vary": "Accept-Encoding"}
+DASHBOARD_GZIP_HEADERS = {**DASHBOARD_HEADERS, "content-encoding": "gzip"}
+
+# Les mesures ne changent qu'à chaque passage du scanner (une fois par minute) :
+# les réponses de l'API sont gardées déjà encodées pendant un cycle de scan
+SCAN_INTERVAL = 60
+_api_cache = TTLCache(maxsize=128, ttl=SCAN_INTERVAL)
+_api_cache_lock = threading.Lock()
+
+# Périodes de l'historique : période → (heures, intervalle_minutes)
+HISTORY_PERIODS = {
+    "1": (1, 1),              # 1h → données brutes (1 min)
+    "6": (6, 30),             # 6h → agrégé 30 min
+    "24": (24, 60),           # 24h → agrégé 1h
+    "168": (168, 720),        # 7j → agrégé 12h
+    "720": (720, 1440),       # 30j → agrégé 1 jour
+    "4320": (4320, 21600),    # 6 mois → agrégé 15 jours
+    "8760": (8760, 43200),    # 1 an → agrégé 1 mois
+}
+
+async def startup():
+    """Démarrage du service (appelé par le lifespan de l'application)"""
+    await run_in_threadpool(db.init_db)
+
+async def shutdown():
+    """Arrêt du service (appelé par le lifespan de l'application)"""
+    db.close_db()
 
 @router.get("/", response_class=HTMLResponse)
 async def wifi_dashboard(request: Request):
     """Page principale du dashboard WiFi"""
-    html_path = BASE_DIR / "templates" / "wifi" / "dashboard.html"
-    return FileResponse(html_path)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return HTMLResponse(DASHBOARD_GZIP, headers=DASHBOARD_GZIP_HEADERS)
+    return HTMLResponse(DASHBOARD_HTML, headers=DASHBOARD_HEADERS)
+
+def cached_api(func):
+    """Sert la réponse JSON depuis _api_cache, clé (fonction, paramètres)
+    
+    Seuls les corps déjà sérialisés sont mémorisés ; les réponses d'erreur
+    (dict) ne sont pas mises en cache
+    """
+    @functools.wraps(func)
+    def wrapper(**kwargs):
+        key = (func.__name__, tuple(sorted(kwargs.items())))
+        with _api_cache_lock:
+            body = _api_cache.get(key)
+        if body is None:
+            response = func(**kwargs)
+            if not isinstance(response, Response):
+                return response
+            body = response.body
+            with _api_cache_lock:
+                _api_cache[key] = body
+        return Response(body, media_type="application/json")
+    return wrapper
 
 # Routes API compatibles avec l'ancien dashboard
+# Handlers synchrones (def) : FastAPI les exécute dans son threadpool,
+# les appels SQLite ne bloquent donc pas la boucle d'événements.
+# Les résultats sont renvoyés dans un ORJSONResponse explicite : FastAPI ne
+# les repasse pas dans jsonable_encoder (parcours Python de chaque valeur)
 @router.get("/api/stats")
-async def api_stats(hours: int = 24):
+@cached_api
+def api_stats(hours: int = 24):
     """API pour les statistiques globales (format compatible ancien dashboard)"""
     stats_list = db.get_latest_stats(hours)
     
     # Convertir en dictionnaire avec host comme clé (format ancien dashboard)
-    stats_dict = {}
-    for stat in stats_list:
-        stats_dict[stat['host']] = {
+    stats_dict = {
+        stat['host']: {
             'total_pings': stat['sample_count'],
             'avg_latency': stat['avg_latency'],
             'min_latency': stat['min_latency'],
@@ -42,11 +103,13 @@ async def api_stats(hours: int = 24):
             'timeouts': stat['total_outages'],
             'uptime':  stat['uptime_percent']  # Renommer uptime_percent -> uptime
         }
+        for stat in stats_list
+    }
     
-    return stats_dict
+    return ORJSONResponse(stats_dict)
 
 @router.get("/api/history/custom")
-async def api_custom_history(start:  str, end: str):
+def api_custom_history(start:  str, end: str):
     """
     API pour une période personnalisée
     
@@ -63,12 +126,13 @@ async def api_custom_history(start:  str, end: str):
         end_datetime = f"{end} 23:59:59"
         
         history = db.get_custom_period_history(start_datetime, end_datetime, max_points=30)
-        return history
+        return ORJSONResponse(history)
     except Exception as e: 
         return {"error": str(e)}
         
 @router.get("/api/history/{period}")
-async def api_history(period: str):
+@cached_api
+def api_history(period: str):
     """
     API pour l'historique avec agrégation automatique selon la période
     
@@ -81,38 +145,28 @@ async def api_history(period: str):
     - 4320: 6 derniers mois (agrégé 15 jours)
     - 8760: 1 an (agrégé 1 mois)
     """
-    # Mapping période → (heures, intervalle_minutes)
-    periods = {
-        "1": (1, 1),              # 1h → données brutes (1 min)
-        "6": (6, 30),             # 6h → agrégé 30 min
-        "24": (24, 60),           # 24h → agrégé 1h
-        "168": (168, 720),        # 7j → agrégé 12h
-        "720": (720, 1440),       # 30j → agrégé 1 jour
-        "4320": (4320, 21600),    # 6 mois → agrégé 15 jours
-        "8760": (8760, 43200),    # 1 an → agrégé 1 mois
-    }
-    
-    if period not in periods:
+    if period not in HISTORY_PERIODS:
         return {"error": "Invalid period"}
     
-    hours, interval = periods[period]
+    hours, interval = HISTORY_PERIODS[period]
     
-    # Pour les courtes périodes, utiliser les données brutes
+    # Pour les courtes périodes, utiliser les données brutes (JSON déjà
+    # sérialisé par SQLite)
     if interval == 1:
-        history = db.get_history(hours)
-    else:
-        history = db.get_aggregated_history(hours, interval)
+        return Response(db.get_history_json(hours), media_type="application/json")
     
-    return history
+    return ORJSONResponse(db.get_aggregated_history(hours, interval))
 
 @router.get("/api/summary")
-async def api_summary(hours: int = 24):
+@cached_api
+def api_summary(hours: int = 24):
     """API pour le résumé"""
     summary = db.get_summary_stats(hours)
-    return summary
+    return ORJSONResponse(summary)
 
 @router.get("/api/outages/{hours}")
-async def api_outages(hours: int = 24):
+@cached_api
+def api_outages(hours: int = 24):
     """API pour les pannes (compatible ancien dashboard)"""
     outages = db.get_outages(hours)
-    return outages
\ No newline at end of file
+    return ORJSONResponse(outages)
\ No newline at end of file
@@ -4,13 +4,14 @@ Script de monitoring WiFi - Ping le routeur et enregistre les stats
 Adapté pour la nouvelle structure home-serveur
 """
 
+import asyncio
+import calendar
 import re
 import sqlite3
-import subprocess
 import sys
 import os
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
 
 # Forcer le fuseau horaire local
@@ -28,6 +29,16 @@ HOSTS = [
     "8.8.8.8",          # Google DNS (Internet)
 ]
 
+# Rétention des mesures brutes (jours) : l'historique plus ancien reste
+# disponible dans les tables d'agrégats (ping_rollup_*)
+RETENTION_DAYS = 30
+# Pages libres rendues au système à chaque passage (PRAGMA incremental_vacuum)
+VACUUM_PAGES = 1000
+
+# Résumé de la commande ping, compilé une seule fois
+PACKET_PATTERN = re.compile(r'(\d+) packets transmitted, (\d+) received, ([\d.]+)% packet loss')
+RTT_PATTERN = re.compile(r'rtt min/avg/max/[a-z]+ = ([\d.]+)/([\d.]+)/([\d.]+)')
+
 def log_message(message):
     """Enregistre un message dans le fichier de log"""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -39,24 +50,30 @@ def log_message(message):
     
     print(log_entry.strip())
 
-def ping_host(host, count=4, timeout=2):
+async def ping_host(host, count=4, timeout=2):
     """
     Ping un hôte et retourne les statistiques
+    Le processus ping est attendu sans bloquer : les hôtes sont pingés en parallèle
     
     Returns:
         dict: Statistiques du ping ou None si erreur
     """
     try: 
-        result = subprocess.run(
-            ['ping', '-c', str(count), '-W', str(timeout), host],
-            capture_output=True,
-            text=True,
-            timeout=timeout * count + 5
+        process = await asyncio.create_subprocess_exec(
+            'ping', '-c', str(count), '-W', str(timeout), host,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL
         )
+        try:
+            stdout, _ = await asyncio.wait_for(process.communicate(), timeout * count + 5)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
         
-        return parse_ping_output(result.stdout, result.returncode)
+        return parse_ping_output(stdout.decode(errors='replace'), process.returncode)
     
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         log_message(f"❌ Timeout lors du ping de {host}")
         return {
             'min':  None,
@@ -86,17 +103,16 @@ def parse_ping_output(output, return_code):
     }
     
     # Extraire les statistiques de paquets
-    packet_pattern = r'(\d+) packets transmitted, (\d+) received, ([\d.]+)% packet loss'
-    packet_match = re.search(packet_pattern, output)
+    packet_match = PACKET_PATTERN.search(output)
     
     if packet_match:
         stats['transmitted'] = int(packet_match.group(1))
         stats['received'] = int(packet_match.group(2))
         stats['loss'] = float(packet_match.group(3))
     
-    # Extraire les temps de réponse (RTT)
-    rtt_pattern = r'rtt min/avg/max/[a-z]+ = ([\d.]+)/([\d.]+)/([\d.]+)'
-    rtt_match = re.search(rtt_pattern, output)
+    # Extraire les temps de réponse (RTT), qui suivent le résumé des paquets.
+    # Recherche indépendante : le résumé peut ne pas correspondre (ex: "+1 errors")
+    rtt_match = RTT_PATTERN.search(output, packet_match.end() if packet_match else 0)
     
     if rtt_match:
         stats['min'] = float(rtt_match.group(1))
@@ -105,55 +121,85 @@ def parse_ping_output(output, return_code):
     
     return stats
 
-def save_to_db(host, stats):
-    """Enregistre les statistiques dans la base de données"""
+def save_to_db(results):
+    """Enregistre les statistiques d'un cycle de scan dans la base de données
+    Une seule transaction (un seul commit) pour tous les hôtes, qui supprime
+    aussi les mesures plus anciennes que RETENTION_DAYS
+    
+    Args:
+        results: Liste de (host, stats, measured_at)
+    """
+    if not results:
+        return
+    
     try: 
         DB_PATH.parent.mkdir(parents=True, exist_ok=True)
         
-        conn = sqlite3.connect(str(DB_PATH))
-        cursor = conn.cursor()
-
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        cursor.execute('''
-            INSERT INTO ping_stats 
-            (timestamp, host, min_latency, avg_latency, max_latency, packet_loss, 
-             packets_transmitted, packets_received, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            current_time,
-            host,
-            stats['min'],
-            stats['avg'],
-            stats['max'],
-            stats['loss'],
-            stats['transmitted'],
-            stats['received'],
-            stats['status']
-        ))
+        rows = [
+            (
+                measured_at.strftime('%Y-%m-%d %H:%M:%S'),
+                # Heure locale en secondes (même référence que strftime('%s', timestamp))
+                calendar.timegm(measured_at.timetuple()),
+                host,
+                stats['min'],
+                stats['avg'],
+                stats['max'],
+                stats['loss'],
+                stats['transmitted'],
+                stats['received'],
+                stats['status']
+            )
+            for host, stats, measured_at in results
+        ]
+        retention_cutoff = calendar.timegm((datetime.now() - timedelta(days=RETENTION_DAYS)).timetuple())
         
-        conn.commit()
+        conn = sqlite3.connect(str(DB_PATH))
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')  # le dashboard peut lire en même temps
+        with conn:
+            conn.executemany('''
+                INSERT INTO ping_stats 
+                (timestamp, ts_epoch, host, min_latency, avg_latency, max_latency, packet_loss, 
+                 packets_transmitted, packets_received, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            # Les agrégats ne sont tenus à jour qu'à l'insertion : la
+            # suppression ne les modifie pas
+            conn.execute('DELETE FROM ping_stats WHERE ts_epoch < ?', (retention_cutoff,))
+        # executescript exécute le PRAGMA jusqu'au bout (execute ne libère
+        # qu'une page par appel)
+        conn.executescript(f'PRAGMA incremental_vacuum({VACUUM_PAGES})')
         conn.close()
         
-        log_message(f"✅ Données enregistrées pour {host} - Latence: {stats['avg']}ms, Perte: {stats['loss']}%")
-        
+        for host, stats, _ in results:
+            log_message(f"✅ Données enregistrées pour {host} - Latence: {stats['avg']}ms, Perte: {stats['loss']}%")
+    
     except Exception as e:
         log_message(f"❌ Erreur lors de l'enregistrement dans la DB: {e}")
 
-def main():
+async def measure_host(host):
+    """Ping un hôte et retourne (host, stats, heure de la mesure)"""
+    log_message(f"📡 Ping de {host}...")
+    stats = await ping_host(host)
+    return host, stats, datetime.now()
+
+async def main():
     """Fonction principale"""
     log_message("🚀 Début du monitoring WiFi")
     
-    for host in HOSTS:
-        log_message(f"📡 Ping de {host}...")
-        stats = ping_host(host)
-        
+    # Tous les hôtes en même temps : le cycle dure le temps du ping le plus lent
+    measures = await asyncio.gather(*(measure_host(host) for host in HOSTS))
+    
+    results = []
+    for host, stats, measured_at in measures:
         if stats:
-            save_to_db(host, stats)
+            results.append((host, stats, measured_at))
         else:
             log_message(f"⚠️ Impossible de récupérer les stats pour {host}")
     
+    save_to_db(results)
+    
     log_message("✅ Monitoring WiFi terminé\n")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file